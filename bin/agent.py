@@ -1,4 +1,3 @@
-import sys
 import logging
 
 from eprint import deb
@@ -205,9 +204,7 @@ class Agent(Actor):
         """
         # Update desire in case boxes are involved
         if self.desire.is_box_desire():
-            __debug_msg = "Adapting route and desire locations..."
-            print(__debug_msg, file=sys.stderr, flush=True)
-            log.debug(__debug_msg)
+            log.debug("Adapting route and desire locations...")
             
             # The agent is too close to where it wants to go
             if len(route) == 1:
@@ -219,9 +216,7 @@ class Agent(Actor):
                 route = route[:-1]
                 self.desire.location = route[-1:][0]
                 
-            __debug_msg = "Route adapted. New route is %s." % route
-            print(__debug_msg, file=sys.stderr, flush=True)
-            log.debug(__debug_msg)
+            log.debug("Route adapted. New route is %s.", route)
 
         return route
     
@@ -0,0 +1,77 @@
+import logging
+import numpy as np
+
+from distance import DistanceTable
+
+
+log = logging.getLogger(__name__)
+
+
+class TaskAllocator(object):
+    """Shares out box tasks (bring a box to its destination) among agents of the
+    same color, keeping the busiest agent as little busy as possible (makespan).
+
+    Tasks are handed out by a greedy auction: at every round each agent bids, for
+    every task left, the time at which it would be done with it (its load so far,
+    plus walking from where its last task ends to the box, plus moving the box),
+    and the lowest bid wins. The tasks of an agent come in the order it won them,
+    which is also a sensible order to carry them out.
+    """
+
+    def __init__(self, level: 'Level'):
+        self.__level = level
+
+    def allocate(self, agents: ['Agent', ...], boxes: ['Box', ...], loads: [int, ...] = None) -> [['Box', ...], ...]:
+        """Share boxes (with a destination) out among agents able to move them all.
+
+        Args:
+            loads (list, optional): time steps each agent is busy for already (default 0)
+
+        Returns:
+            list: the boxes of every agent, in the order to move them
+        """
+        tasks = [[] for _ in agents]
+
+        if not agents or not boxes:
+            return tasks
+
+        level = self.__level
+        num_agents = len(agents)
+        box_cells = [level.index_of(box.location) for box in boxes]
+        sources = np.array(
+            [level.index_of(agent.location) for agent in agents] +
+            [level.index_of(box.destination) for box in boxes]
+        )
+
+        # travel[s, t]: from source s (agent start or end of task) to the box of task t
+        travel = np.stack(
+            [np.asarray(level.distances.distances_to(cell))[sources] for cell in box_cells], axis=1
+        ).astype(np.float64)
+        travel[travel >= DistanceTable.UNREACHABLE] = np.inf
+        work = travel[num_agents + np.arange(len(boxes)), np.arange(len(boxes))]
+
+        load = np.array(loads if loads is not None else [0] * num_agents, dtype=np.float64)
+        end = np.arange(num_agents)  # Source each agent starts its next task from
+        left = np.ones(len(boxes), dtype=bool)
+
+        while left.any():
+            bids = load[:, None] + travel[end] + work
+            bids[:, ~left] = np.inf
+
+            if not np.isfinite(bids).any():
+                # Nobody can reach them: kept by the least busy agent, so that no box is forgotten
+                log.debug("%d boxes are out of reach of agents %s.", left.sum(), agents)
+                tasks[int(np.argmin(load))].extend(boxes[nt] for nt in np.flatnonzero(left).tolist())
+                break
+
+            na, nt = np.unravel_index(np.argmin(bids), bids.shape)
+            tasks[na].append(boxes[nt])
+            load[na] = bids[na, nt]
+            end[na] = num_agents + nt
+            left[nt] = False
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "Tasks of agents %s: %s, makespan %d.", agents, [len(t) for t in tasks], load.max() if len(load) else 0
+            )
+        return tasks
@@ -0,0 +1,119 @@
+import time
+import logging
+
+from frontier import Frontier
+from state import State
+
+
+log = logging.getLogger(__name__)
+
+
+class AnytimeSearch(object):
+    """Anytime Repairing A* (ARA*) over states.
+
+    A first plan is found with weighted A* (f = g + weight * heuristic, the
+    heuristic being State.h without g), which expands few states. The weight is
+    then lowered step by step down to 1 and the search goes on from where it
+    left off: states reached again with a lower cost while explored wait in an
+    inconsistent list and join the frontier for the next weight, instead of the
+    search starting over. Every goal cheaper than the best one becomes the new best.
+
+    The search stops at the end of the time budget or after the weight 1 iteration,
+    and returns the best goal found. The budget is only enforced once there is a
+    plan: until then the search goes on.
+    """
+    WEIGHT = 5.0  # Weight of the first iteration
+    WEIGHT_STEP = 1.0  # Weight decrease after each iteration
+
+    def __init__(self, initial: State, budget: float, weight: float = WEIGHT, weight_step: float = WEIGHT_STEP):
+        """
+        Args:
+            budget (float): wall-clock seconds for the whole search
+            weight (float, optional): weight of the first iteration (>= 1)
+        """
+        self.__initial = initial
+        self.__budget = budget
+        self.__weight = max(1.0, weight)
+        self.__weight_step = weight_step
+
+        self.best = None  # Best goal state found so far
+
+        # Node counts, comparable with the joint search
+        self.nodes = {'expanded': 0, 'generated': 0, 'iterations': 0, 'plans': 0}
+
+    def __f(self, state: State, weight: float) -> float:
+        return state._g + weight * (state.h - state._g)
+
+    def __improve(self, frontier: Frontier, states: dict, closed: set, incons: dict, weight: float, deadline):
+        """Expand states until the best plan cannot be improved with this weight.
+        """
+        while frontier:
+            if self.best is not None:
+                # The heuristic is not 0 at goals (agents away from their target)
+                if frontier.peek()[0] >= self.__f(self.best, weight):
+                    return
+                if time.perf_counter() > deadline:
+                    return
+
+            _, state = frontier.get()
+            closed.add(state)
+            self.nodes['expanded'] += 1
+
+            if state.is_goal_state():
+                if self.best is None or state._g < self.best._g:
+                    self.best = state
+                    self.nodes['plans'] += 1
+                    log.debug("ARA* plan of %d steps with weight %s.", state._g, weight)
+                continue
+
+            for n in state.get_expanded_states():
+                self.nodes['generated'] += 1
+                known = states.get(n)
+
+                if known is not None and known._g <= n._g:
+                    continue
+
+                # Cannot lead to a cheaper plan
+                if self.best is not None and n._g >= self.best._g:
+                    continue
+                states[n] = n
+
+                if n in closed:
+                    incons[n] = n
+                else:
+                    frontier.put(self.__f(n, weight), n)
+
+    def solve(self) -> State:
+        """Best goal state found within the budget, with the parents leading to it
+        from the initial state. None if there is no plan.
+        """
+        initial = self.__initial
+        weight = self.__weight
+
+        frontier = Frontier()
+        frontier.put(self.__f(initial, weight), initial)
+        states = {initial: initial}  # Cheapest state found for every position
+        incons = {}
+        deadline = time.perf_counter() + self.__budget
+
+        while True:
+            self.nodes['iterations'] += 1
+            closed = set()
+            self.__improve(frontier, states, closed, incons, weight, deadline)
+
+            if self.best is None:
+                # Nothing left to explore
+                return None
+
+            if weight <= 1.0 or time.perf_counter() > deadline:
+                return self.best
+
+            # Next weight: the frontier and the inconsistent states, with their new priorities
+            weight = max(1.0, weight - self.__weight_step)
+            _frontier = Frontier()
+
+            for state in list(frontier.items()) + list(incons.values()):
+                _frontier.put(self.__f(state, weight), state)
+
+            frontier = _frontier
+            incons = {}
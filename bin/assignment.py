@@ -0,0 +1,166 @@
+import logging
+import numpy as np
+
+from distance import DistanceTable
+
+
+log = logging.getLogger(__name__)
+
+
+def linear_assignment(cost: np.ndarray) -> (np.ndarray, np.ndarray):
+    """Minimum cost assignment of rows to columns (Hungarian method, shortest
+    augmenting paths with potentials), O(n² m) with the inner loop over columns in NumPy.
+
+    Args:
+        cost (np.ndarray): (n, m) cost matrix. With more rows than columns, only
+        as many rows as columns are assigned.
+
+    Returns:
+        tuple: row indexes and their column indexes, by increasing row
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+
+    if cost.shape[0] > cost.shape[1]:
+        cols, rows = linear_assignment(cost.T)
+        order = np.argsort(rows)
+        return rows[order], cols[order]
+
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.int64)  # Row (1-based) assigned to every column, 0 for none
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for row in range(1, n + 1):
+        owner[0] = row
+        col = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        # Shortest augmenting path from the new row to a free column
+        while True:
+            used[col] = True
+            current = cost[owner[col] - 1] - u[owner[col]] - v[1:]
+            free = ~used[1:]
+
+            better = free & (current < minv[1:])
+            minv[1:][better] = current[better]
+            way[1:][better] = col
+
+            candidates = np.where(free, minv[1:], np.inf)
+            next_col = int(np.argmin(candidates)) + 1
+            delta = candidates[next_col - 1]
+
+            u[owner[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+
+            col = next_col
+            if owner[col] == 0:
+                break
+
+        # Flip the path
+        while col:
+            previous = way[col]
+            owner[col] = owner[previous]
+            col = previous
+
+    cols = np.flatnonzero(owner[1:])
+    rows = owner[cols + 1] - 1
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+class GoalAssignment(object):
+    """Destinations of the boxes: every letter class (boxes and goals with the same
+    letter) is solved at once as a minimum total distance assignment, with the true
+    shortest path distances. Goals no box can reach are never assigned.
+
+    Classes can be solved again on their own (see reassign) when boxes were moved
+    around, leaving the other classes untouched.
+    """
+
+    def __init__(self, level: 'Level', goals: {'Location': 'Goal'}):
+        self.__level = level
+
+        # Goal locations per letter
+        self.__goals = {}
+        for loc, goal in goals.items():
+            self.__goals.setdefault(goal.identifier, []).append(loc)
+
+        self.__distances = {}  # Goal cell: distances from every cell, on first use
+
+    def __distances_to(self, loc: 'Location') -> np.ndarray:
+        cell = self.__level.index_of(loc)
+        distances = self.__distances.get(cell)
+
+        if distances is None:
+            distances = self.__distances[cell] = np.asarray(self.__level.distances.distances_to(cell))
+        return distances
+
+    def solve(self, boxes: ['Box', ...], goals: ['Location', ...]) -> [('Box', 'Location'), ...]:
+        """Assign goals to boxes (of the same letter).
+
+        Returns:
+            list: (box, goal location or None) for every box, in order
+        """
+        if not boxes or not goals:
+            return [(box, None) for box in boxes]
+
+        cells = np.array([self.__level.index_of(box.location) for box in boxes])
+        cost = np.stack([self.__distances_to(goal)[cells] for goal in goals], axis=1)
+        rows, cols = linear_assignment(cost)
+
+        destinations = [None] * len(boxes)
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            if cost[row, col] < DistanceTable.UNREACHABLE:
+                destinations[row] = goals[col]
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "Assigned %d of %d boxes to %d goals, total distance %d.",
+                sum(d is not None for d in destinations), len(boxes), len(goals),
+                sum(cost[r, c] for r, c in zip(rows, cols) if cost[r, c] < DistanceTable.UNREACHABLE)
+            )
+        return list(zip(boxes, destinations))
+
+    def assign(self, boxes: ['Box', ...]) -> [('Box', 'Location'), ...]:
+        """Destinations of all the boxes, one letter class at a time.
+
+        Returns:
+            list: (box, goal location or None) for every box, in order
+        """
+        destinations = []
+
+        for letter in dict.fromkeys(box.identifier for box in boxes):
+            same_letter = [box for box in boxes if box.identifier == letter]
+            destinations.extend(self.solve(same_letter, self.__goals.get(letter, [])))
+
+        order = {id(box): n for n, box in enumerate(boxes)}
+        return sorted(destinations, key=lambda pair: order[id(pair[0])])
+
+    def reassign(self, letter: str, boxes: ['Box', ...], fixed=()) -> [('Box', 'Location'), ...]:
+        """Solve a letter class again from where the boxes are now.
+
+        Boxes on their destination and fixed boxes (e.g. being moved right now) keep
+        their destination, the others share the goals left.
+
+        Returns:
+            list: (box, new destination) for the boxes whose destination changed
+        """
+        fixed = set(map(id, fixed))
+        same_letter = [box for box in boxes if box.identifier == letter]
+        kept = [
+            box for box in same_letter
+            if id(box) in fixed or (box.destination is not None and box.location == box.destination)
+        ]
+        taken = [box.destination for box in kept if box.destination is not None]
+
+        kept_ids = set(map(id, kept))
+        movable = [box for box in same_letter if id(box) not in kept_ids]
+        goals = [loc for loc in self.__goals.get(letter, []) if loc not in taken]
+
+        return [
+            (box, destination) for box, destination in self.solve(movable, goals)
+            if destination != box.destination
+        ]
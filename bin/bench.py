@@ -0,0 +1,371 @@
+"""Offline batch solver and benchmark over a corpus of levels.
+
+Usage:
+    $ python -m bin.bench levels/
+    $ python -m bin.bench levels/ -j 4 -t 120 --json report.json
+    $ python -m bin.bench levels/ --baseline report.json
+    $ python -m bin.bench levels/ --reject 5
+
+Every level runs in its own worker process, with the whole client (parse_level,
+Controller) talking to an in-process stand-in for the server (see ServerStandIn)
+that executes and validates the joint actions. A level is solved when every goal
+is met once the client is done. The report gives per level the solve time, the
+states expanded and generated by the searches, the peak RSS and the plan length.
+
+With --baseline, the run is compared with a previous JSON report: levels no longer
+solved, slower beyond the tolerance or with longer plans are regressions, and the
+exit status is 1 if there is any.
+
+With --reject N, the stand-in also rejects an action of the N-th joint action (a fault
+injected whatever the plan), and every level with rejected actions must have had its
+plan repaired by the client (see Controller.__repair), or the exit status is 1.
+
+The state search and the planner alone are timed by microbench.py.
+"""
+import os
+import io
+import sys
+import csv
+import json
+import time
+import signal
+import argparse
+import threading
+import multiprocessing
+
+from multiprocessing.connection import wait
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client import Client  # noqa: E402
+from controller import Controller  # noqa: E402
+from simulator import Simulator  # noqa: E402
+import profiling  # noqa: E402
+from action import Action  # noqa: E402
+
+
+FIELDS = (
+    'level', 'solved', 'time', 'length', 'rejected', 'repairs', 'expanded', 'generated', 'peak_rss_mb', 'error'
+)
+
+ROW = '{:<40}{:>8}{:>10}{:>8}{:>10}{:>9}{:>12}{:>12}{:>13}'
+
+ACTIONS = {action.name_: action for action in Action}
+
+
+class ServerStandIn(object):
+    """In-process stand-in for the server, used as both stdin and stdout of the client.
+
+    Joint actions written by the client ("Move(N)|NoOp|...") are executed on the
+    level with the server rules (see Simulator). Each joint action gets its response
+    ("true|false|...") on readline, which blocks until there is one, or returns ''
+    once the stand-in is closed.
+    """
+
+    def __init__(self, level: str, reject: int = None):
+        """
+        Args:
+            reject (int, optional): from this joint action (counted from 1) on, the first
+            one with an action other than NoOp gets that action rejected, as a fault injected
+        """
+        self.__simulator = Simulator(*Client.parse_level(io.StringIO(level)).build_structure())
+        self.__reject = reject
+
+        self.actions = 0
+        self.rejected = 0
+        self.__injected = False
+        self.__buffer = ''
+        self.__responses = []
+        self.__closed = False
+        self.__condition = threading.Condition()
+
+    def write(self, text: str) -> int:
+        self.__buffer += text
+
+        while '\n' in self.__buffer:
+            line, self.__buffer = self.__buffer.split('\n', 1)
+
+            if line.strip():
+                response = self.__execute(line.strip().split('|'))
+
+                with self.__condition:
+                    self.__responses.append(response)
+                    self.__condition.notify_all()
+
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def readline(self) -> str:
+        with self.__condition:
+            while not self.__responses and not self.__closed:
+                self.__condition.wait()
+
+            if not self.__responses:
+                return ''
+            return self.__responses.pop(0) + '\n'
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    @property
+    def is_solved(self) -> bool:
+        return self.__simulator.is_solved
+
+    def __execute(self, names: [str, ...]) -> str:
+        """Apply the joint action, return the server response for it.
+        Joint actions with unknown actions, or not one action per agent, fail entirely.
+        """
+        joint_action = [ACTIONS.get(name.strip()) for name in names]
+
+        if None in joint_action or len(joint_action) != len(self.__simulator.agents):
+            results = [False] * len(names)
+        elif self.__reject and self.actions + 1 >= self.__reject and not self.__injected and \
+                any(action is not Action.NoOp for action in joint_action):
+            n = next(n for n, action in enumerate(joint_action) if action is not Action.NoOp)
+            joint_action[n] = Action.NoOp
+            results = self.__simulator.step(joint_action)
+            results[n] = False
+            self.__injected = True
+        else:
+            results = self.__simulator.step(joint_action)
+
+        self.actions += 1
+        self.rejected += not all(results)
+        return '|'.join('true' if result else 'false' for result in results)
+
+
+def solve(path: str, options: dict, connection, reject: int = None):
+    """Worker process: solve the level and send its report through the connection.
+    """
+    # The worker and the processes it starts (see ParallelExpander) are stopped together
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+
+    with open(path) as level_file:
+        text = level_file.read()
+
+    report = dict.fromkeys(FIELDS)
+    report['level'] = os.path.basename(path)
+
+    # The client talks to the stand-in, its debug messages go nowhere
+    sys.stderr = open(os.devnull, 'w')
+    server = ServerStandIn(text, reject)
+    sys.stdin = sys.stdout = server
+
+    start = time.perf_counter()
+    controller = None
+
+    try:
+        configuration = Client.parse_level(io.StringIO(text), options)
+        controller = Controller(configuration)
+        profiling.deploy(controller, configuration)
+    except BaseException as e:
+        report['error'] = '%s: %s' % (type(e).__name__, e)
+
+    report['time'] = round(time.perf_counter() - start, 3)
+    server.close()
+
+    report['solved'] = server.is_solved
+    report['length'] = server.actions
+    report['rejected'] = server.rejected
+
+    if controller is not None:
+        report['repairs'] = controller.repairs
+        report['expanded'] = controller.metrics.counters['expanded']
+        report['generated'] = controller.metrics.counters['generated']
+
+    try:
+        import resource
+        report['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        pass
+
+    connection.send(report)
+    connection.close()
+
+
+def run(paths: [str, ...], options: dict, jobs: int, timeout: float, reject: int = None) -> [dict, ...]:
+    """Solve the levels in up to jobs worker processes, each with the given timeout
+    (and the fault injected, see ServerStandIn).
+
+    Returns:
+        list: one report per level (see FIELDS), in the order of the paths
+    """
+    reports = {}
+    pending = list(paths)
+    running = {}  # connection: (path, process, deadline)
+
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                path = pending.pop(0)
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                # Not daemonic: workers may start processes of their own (--workers)
+                process = multiprocessing.Process(target=solve, args=(path, options, sender, reject))
+                process.start()
+                sender.close()
+                running[receiver] = (path, process, time.perf_counter() + timeout)
+
+            now = time.perf_counter()
+            ready = wait(list(running), timeout=max(0.0, min(d for _, _, d in running.values()) - now))
+
+            for connection in list(running):
+                path, process, deadline = running[connection]
+
+                if connection in ready:
+                    try:
+                        report = connection.recv()
+                    except EOFError:
+                        report = dict.fromkeys(FIELDS, None)
+                        report.update(level=os.path.basename(path), solved=False, error='worker died')
+                elif time.perf_counter() >= deadline:
+                    stop(process)
+                    report = dict.fromkeys(FIELDS, None)
+                    report.update(level=os.path.basename(path), solved=False, time=timeout, error='timeout')
+                else:
+                    continue
+
+                process.join()
+                connection.close()
+                del running[connection]
+                reports[path] = report
+                print(format_row(report), flush=True)
+    finally:
+        # Interrupted: the workers would be waited for on exit
+        for path, process, _ in running.values():
+            stop(process)
+            process.join()
+
+    return [reports[path] for path in paths]
+
+
+def stop(process: multiprocessing.Process):
+    """Terminate a worker process, with the processes it started.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (AttributeError, OSError):
+        # No process group (yet)
+        process.terminate()
+
+
+def format_row(report: dict) -> str:
+    def value(field):
+        return '-' if report[field] is None else report[field]
+
+    return ROW.format(
+        report['level'], 'yes' if report['solved'] else 'no', *(value(f) for f in FIELDS[2:-1])
+    ) + '  ' + (report['error'] or '')
+
+
+def compare(reports: [dict, ...], baseline: [dict, ...], tolerance: float) -> [str, ...]:
+    """Regressions of the reports against the baseline ones, by level.
+    A level is slower when it takes more than (1 + tolerance) times as long, and at least a second more.
+    """
+    previous = {report['level']: report for report in baseline}
+    regressions = []
+
+    for report in reports:
+        old = previous.get(report['level'])
+
+        if old is None or not old['solved']:
+            continue
+
+        if not report['solved']:
+            regressions.append('%s: no longer solved (%s)' % (report['level'], report['error'] or 'unsolved'))
+            continue
+
+        if report['time'] > old['time'] * (1 + tolerance) and report['time'] - old['time'] > 1:
+            regressions.append('%s: %.3f s, was %.3f s' % (report['level'], report['time'], old['time']))
+
+        if report['length'] > old['length']:
+            regressions.append('%s: plan of %d actions, was %d' % (report['level'], report['length'], old['length']))
+
+    return regressions
+
+
+def find_levels(inputs: [str, ...]) -> [str, ...]:
+    paths = []
+
+    for path in inputs:
+        if os.path.isdir(path):
+            paths += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.lvl'))
+        else:
+            paths.append(path)
+
+    return paths
+
+
+def parse_option(text: str) -> (str, object):
+    """key=value client option, e.g. search=decomposition or anytime=2.5.
+    """
+    key, _, value = text.partition('=')
+
+    for convert in (int, float):
+        try:
+            return key, convert(value)
+        except ValueError:
+            pass
+
+    return key, {'true': True, 'false': False, 'none': None}.get(value.lower(), value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline batch solver and benchmark.')
+    parser.add_argument('levels', nargs='+', help='level files or directories of .lvl files')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='worker processes (default: CPUs)')
+    parser.add_argument('-t', '--timeout', type=float, default=180.0, help='seconds per level (default: 180)')
+    parser.add_argument(
+        '-o', '--option', action='append', default=[], metavar='KEY=VALUE',
+        help='client option, as in bin/main.py (e.g. -o search=decomposition -o memory=512)'
+    )
+    parser.add_argument('--csv', metavar='FILE', help='write the report as CSV')
+    parser.add_argument('--json', metavar='FILE', help='write the report as JSON (usable as a baseline)')
+    parser.add_argument('--baseline', metavar='FILE', help='JSON report to compare with')
+    parser.add_argument(
+        '--reject', type=int, metavar='N',
+        help='reject an action of joint action N, and check that rejected actions get repaired'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25, help='relative slow down accepted by the comparison (default: 0.25)'
+    )
+    args = parser.parse_args()
+
+    print(ROW.format(*FIELDS[:-1]))
+    reports = run(
+        find_levels(args.levels), dict(map(parse_option, args.option)), max(1, args.jobs), args.timeout, args.reject
+    )
+
+    solved = [report for report in reports if report['solved']]
+    print('Solved %d/%d levels in %.1f s.' % (len(solved), len(reports), sum(r['time'] for r in solved)))
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(reports)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(reports, json_file, indent=2)
+
+    failures = []
+
+    if args.reject:
+        failures += [
+            '%s: rejected actions never repaired' % report['level']
+            for report in reports if report['rejected'] and not report['repairs']
+        ]
+
+    if args.baseline:
+        with open(args.baseline) as json_file:
+            failures += ['Regression: %s' % r for r in compare(reports, json.load(json_file), args.tolerance)]
+
+    for failure in failures:
+        print(failure)
+
+    sys.exit(1 if failures else 0)
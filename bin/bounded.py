@@ -0,0 +1,105 @@
+import time
+import logging
+
+from math import inf
+
+from state import State
+
+
+log = logging.getLogger(__name__)
+
+
+class IterativeDeepeningSearch(object):
+    """IDA*: depth-first searches bounded by the cost f = g + h (State.h), the bound
+    growing to the lowest f over it after each iteration.
+
+    Only the current path and the successors of its states are kept, so memory
+    grows with the plan length and not with the number of states explored.
+    States are expanded again in every iteration instead.
+
+    The search gives up after max_expanded expansions or budget seconds, if given;
+    IDA* does not run out of memory, so nothing else stops it on a large level.
+    """
+
+    def __init__(self, initial: State, max_expanded: int = None, budget: float = None):
+        self.__initial = initial
+        self.__max_expanded = max_expanded
+        self.__budget = budget
+        self.__deadline = None
+
+        # Node counts
+        self.nodes = {'expanded': 0, 'generated': 0, 'iterations': 0}
+
+    def __successors(self, state: State) -> [State, ...]:
+        self.nodes['expanded'] += 1
+        successors = state.get_expanded_states()
+        self.nodes['generated'] += len(successors)
+
+        # Most promising first
+        successors.sort(key=lambda s: s.h)
+        return successors
+
+    def __search(self, bound) -> (State, float):
+        """Depth-first search up to the bound.
+
+        Returns:
+            tuple: the goal state (or None), and the lowest f over the bound
+        """
+        initial = self.__initial
+        path = {initial}
+        stack = [(initial, iter(self.__successors(initial)))]
+        over = inf
+
+        while stack:
+            if self.__max_expanded and self.nodes['expanded'] > self.__max_expanded:
+                return None, inf
+
+            if self.__deadline and time.perf_counter() > self.__deadline:
+                log.debug("IDA* time budget reached (%s s).", self.__budget)
+                return None, inf
+
+            state, successors = stack[-1]
+            child = next(successors, None)
+
+            if child is None:
+                stack.pop()
+                path.discard(state)
+                continue
+
+            if child in path:
+                continue
+
+            if child.h > bound:
+                over = min(over, child.h)
+                continue
+
+            if child.is_goal_state():
+                return child, bound
+
+            path.add(child)
+            stack.append((child, iter(self.__successors(child))))
+
+        return None, over
+
+    def solve(self) -> State:
+        """Goal state, with the parents leading to it from the initial state. None if
+        there is none (or max_expanded or the time budget was reached).
+        """
+        initial = self.__initial
+        self.__deadline = time.perf_counter() + self.__budget if self.__budget else None
+
+        if initial.is_goal_state():
+            return initial
+
+        bound = initial.h
+
+        while bound < inf:
+            self.nodes['iterations'] += 1
+            log.debug("IDA* iteration %d, bound %s.", self.nodes['iterations'], bound)
+
+            state, bound = self.__search(bound)
+
+            if state is not None:
+                return state
+
+        return None
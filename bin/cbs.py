@@ -0,0 +1,152 @@
+import time
+import logging
+
+from frontier import Frontier
+from state import State
+from decomposition import GroupPlanner, initial_groups, find_conflict, replay
+
+
+log = logging.getLogger(__name__)
+
+
+class _Node(object):
+    """Node of the constraint tree: constraints and plans of every group.
+    """
+    __slots__ = ('constraints', 'plans', 'cost', 'makespan')
+
+    def __init__(self, constraints: dict, plans: dict):
+        self.constraints = constraints  # group: frozenset((cell, time), ...)
+        self.plans = plans  # group: (steps, timeline), see GroupPlanner.plan
+        self.cost = sum(len(steps) for steps, _ in plans.values())
+        self.makespan = max((len(steps) for steps, _ in plans.values()), default=0)
+
+
+class ConflictBasedSearch(object):
+    """Conflict-Based Search over groups of agents (see initial_groups).
+
+    Every group is planned on its own with a space-time GroupPlanner. The high level
+    search is a best first search over a constraint tree: the first conflict of
+    the cheapest node is solved by two children, each forbidding the conflicting
+    cell and time to one of the groups, which is then planned again.
+    Nodes are ordered by the sum of plan lengths, then by makespan.
+
+    Groups that keep conflicting with each other (e.g. swapping places in a corridor)
+    are merged and the search starts over, planning them together (meta-agent CBS).
+
+    Unlike the greedy planner, agents never wait for another agent to finish its
+    whole route: they only wait (or go around) where the plans actually meet.
+
+    The whole search, low level searches included, gives up after budget seconds:
+    the greedy planner it falls back to needs the time left.
+    """
+    MAX_NODES = 2000  # Constraint tree nodes expanded before giving up
+    MAX_EXPANDED = 20000  # States a low level search may expand before giving up
+    MERGE_THRESHOLD = 10  # Conflicts between two groups before they are merged
+    BUDGET = 3.0  # Seconds the whole search may take before giving up
+
+    def __init__(self, initial: State, max_nodes: int = MAX_NODES, max_expanded: int = MAX_EXPANDED,
+                 merge_threshold: int = MERGE_THRESHOLD, budget: float = BUDGET):
+        self.__initial = initial
+        self.__max_nodes = max_nodes
+        self.__max_expanded = max_expanded
+        self.__merge_threshold = merge_threshold
+        self.__budget = budget
+        self.__deadline = None
+
+        # Node counts: low level ones (see GroupPlanner) and constraint tree ones
+        self.nodes = {
+            'expanded': 0, 'intermediate': 0, 'generated': 0, 'groups': 0, 'tree': 0, 'conflicts': 0, 'merges': 0
+        }
+        self.__planner = GroupPlanner(initial, self.nodes)
+
+    def __plan(self, group: (int, ...), constraints=()):
+        return self.__planner.plan(
+            group, constraints, agent_goals=True, max_expanded=self.__max_expanded, deadline=self.__deadline
+        )
+
+    def solve(self) -> State:
+        """Goal state, with the parents leading to it from the initial state.
+
+        Returns:
+            State: the goal state, or None if no plan was found within the limits
+        """
+        groups = initial_groups(self.__initial.context)
+        self.__deadline = time.perf_counter() + self.__budget if self.__budget else None
+
+        while groups is not None:
+            result = self.__search(groups)
+
+            if isinstance(result, State) or result is None:
+                return result
+
+            # Merge and start over
+            first, second = result
+            groups = [group for group in groups if group not in (first, second)]
+            groups.append(tuple(sorted(first + second)))
+            self.nodes['merges'] += 1
+            log.debug("Merging agent groups %s and %s.", first, second)
+
+        return None
+
+    def __search(self, groups: [(int, ...), ...]):
+        """Constraint tree search for the given groups.
+
+        Returns:
+            State or tuple: the goal state, None if there is no plan within the limits,
+            or the two groups to merge
+        """
+        plans = {}
+
+        for group in groups:
+            plans[group] = self.__plan(group)
+
+            if plans[group] is None:
+                log.debug("No plan for agents %s.", group)
+                return None
+
+        conflicts = {}  # (first, second): count
+        frontier = Frontier()
+        frontier.put((0, 0), _Node({group: frozenset() for group in groups}, plans))
+
+        while frontier:
+            _, node = frontier.get()
+            self.nodes['tree'] += 1
+
+            conflict = find_conflict(groups, node.plans)
+
+            if conflict is None:
+                return replay(self.__initial, groups, node.plans)
+
+            if self.nodes['tree'] > self.__max_nodes:
+                log.debug("Constraint tree limit reached (%d nodes).", self.__max_nodes)
+                return None
+
+            if self.__deadline and time.perf_counter() > self.__deadline:
+                log.debug("Time budget reached (%s s).", self.__budget)
+                return None
+
+            self.nodes['conflicts'] += 1
+            first, second, first_constraint, second_constraint = conflict
+
+            pair = (first, second)
+            conflicts[pair] = conflicts.get(pair, 0) + 1
+
+            if conflicts[pair] >= self.__merge_threshold:
+                return pair
+
+            for group, constraint in ((first, first_constraint), (second, second_constraint)):
+                constraints = node.constraints[group].union((constraint, ))
+                plan = self.__plan(group, constraints)
+
+                if plan is None:
+                    continue
+
+                _constraints = dict(node.constraints)
+                _constraints[group] = constraints
+                _plans = dict(node.plans)
+                _plans[group] = plan
+
+                child = _Node(_constraints, _plans)
+                frontier.put((child.cost, child.makespan), child)
+
+        return None
@@ -1,41 +1,76 @@
+import os
 import sys
 import time
 import logging
 
-import cProfile
+from collections import deque
+
+import numpy as np
 
 import memory
+import profiling
 from level import Level
 from color import Color
 from configuration import Configuration
 from controller import Controller
+from stream import ActionStream
 
 
 log = logging.getLogger(__name__)
 
 
 class Client(object):
+    LOOKAHEAD = 8  # Joint actions sent ahead of the server responses
+    MAX_REPAIRS = 20  # Replans after rejected actions before giving up on repairing
+    
     @staticmethod
-    def parse_level(server_messages) -> 'Configuration':
+    def read_message(server_messages) -> str:
+        """The level message of the server, up to #end, in one go.
+
+        From the server (stdin), the pipe is read in large chunks until #end comes in:
+        the server sends nothing else before it gets an action. Any other stream
+        (e.g. a level file) is read whole.
+        """
+        if server_messages is not sys.stdin:
+            return server_messages.read()
+
+        fd = server_messages.fileno()
+        data = bytearray()
+
+        while True:
+            chunk = os.read(fd, 1 << 16)
+            data += chunk
+
+            end = data.find(b'#end')
+            if not chunk or (end >= 0 and data.find(b'\n', end) >= 0):
+                break
+
+        return data.decode('ascii')
+
+    @staticmethod
+    def decode_grid(lines: [str, ...], num_cols: int) -> np.ndarray:
+        """(rows, num_cols) uint8 array with the characters of the given lines,
+        padded with spaces.
+        """
+        raw = ''.join(line.ljust(num_cols) for line in lines).encode('ascii')
+        return np.frombuffer(raw, dtype=np.uint8).reshape(len(lines), num_cols)
+
+    @staticmethod
+    def parse_level(server_messages, options: dict = None) -> 'Configuration':
         log.debug("Parsing messages from server...")
         # We can assume that the level file is conforming to specification, since the server verifies this.
-        # Read domain.
-        server_messages.readline() # #domain
-        server_messages.readline() # hospital
-        
+        lines = Client.read_message(server_messages).splitlines()
+        sections = {line: n for n, line in enumerate(lines) if line.startswith('#')}
+
         # Read Level name.
-        server_messages.readline() # #levelname
-        __name = server_messages.readline() # <name>
-        
-        log.debug("Map name is: %s" % __name.replace("\n", ''))
-        
+        __name = lines[sections['#levelname'] + 1]
+        log.debug("Map name is: %s", __name)
+
         # Read colors.
-        server_messages.readline() # #colors
-        
         agent_colors = [None for _ in range(10)]
         box_colors = [None for _ in range(26)]
-        line = server_messages.readline()
-        while not line.startswith('#'):
+
+        for line in lines[sections['#colors'] + 1:sections['#initial']]:
             split = line.split(':')
             color = Color.from_string(split[0].strip())
             entities = [e.strip() for e in split[1].split(',')]
@@ -44,60 +79,34 @@ class Client(object):
                     agent_colors[ord(e) - ord('0')] = color
                 elif 'A' <= e <= 'Z':
                     box_colors[ord(e) - ord('A')] = color
-            line = server_messages.readline()
-        
-        # Read initial state.
-        # line is currently "#initial".
-        num_rows = 0
-        num_cols = 0
-        level_lines = []
-        line = server_messages.readline()
-        
-        while not line.startswith('#'):
-            level_lines.append(line)
-            num_cols = max(num_cols, len(line) - 1)
-            num_rows += 1
-            line = server_messages.readline()
-
-        num_agents = 0
-        agent_rows = [None for _ in range(10)]
-        agent_cols = [None for _ in range(10)]
-        walls = [[False for _ in range(num_cols)] for _ in range(num_rows)]
-        boxes = [['' for _ in range(num_cols)] for _ in range(num_rows)]
-        row = 0
-        
-        for line in level_lines:
-            for col, c in enumerate(line):
-                if '0' <= c <= '9':
-                    agent_rows[ord(c) - ord('0')] = row
-                    agent_cols[ord(c) - ord('0')] = col
-                    num_agents += 1
-                elif 'A' <= c <= 'Z':
-                    boxes[row][col] = c
-                elif c == '+':
-                    walls[row][col] = True
-            
-            row += 1
-        del agent_rows[num_agents:]
-        del agent_rows[num_agents:]
-        
-        # Read goal state.
-        # line is currently "#goal".
-        goals = [['' for _ in range(num_cols)] for _ in range(num_rows)]
-        line = server_messages.readline()
-        row = 0
-        while not line.startswith('#'):
-            for col, c in enumerate(line):
-                if '0' <= c <= '9' or 'A' <= c <= 'Z':
-                    goals[row][col] = c
-            
-            row += 1
-            line = server_messages.readline()
-        
+
+        # Read initial and goal states as character grids.
+        level_lines = lines[sections['#initial'] + 1:sections['#goal']]
+        goal_lines = lines[sections['#goal'] + 1:sections['#end']]
+        num_cols = max(len(line) for line in level_lines)
+
+        initial = Client.decode_grid(level_lines, num_cols)
+        goal = Client.decode_grid(goal_lines + [''] * (len(level_lines) - len(goal_lines)), num_cols)
+
+        is_agent = (initial >= ord('0')) & (initial <= ord('9'))
+        is_box = (initial >= ord('A')) & (initial <= ord('Z'))
+        is_goal = ((goal >= ord('0')) & (goal <= ord('9'))) | ((goal >= ord('A')) & (goal <= ord('Z')))
+
+        walls = (initial == ord('+')).astype(np.uint8)
+        boxes = np.where(is_box, initial, 0).astype(np.uint8)
+        goals = np.where(is_goal, goal, 0).astype(np.uint8)
+
+        # Agents, by number
+        agent_rows, agent_cols = np.nonzero(is_agent)
+        order = np.argsort(initial[agent_rows, agent_cols], kind='stable')
+        agent_rows = agent_rows[order].tolist()
+        agent_cols = agent_cols[order].tolist()
+
         # End.
-        # line is currently "#end".
         log.debug("Finished parsing messages from server.")
         return Configuration({
+            'name': __name,
+            
             'walls': walls,
             
             # Boxes
@@ -109,10 +118,10 @@ class Client(object):
             'agent_colors': agent_colors,
             
             'goals': goals
-        })
+        }, options)
 
     @staticmethod
-    def boot_up() -> None:
+    def boot_up(options: dict = None) -> None:
         # Send client name to server.
         if hasattr(sys.stdout, "reconfigure"):
             sys.stdout.reconfigure(encoding='ASCII')
@@ -126,23 +135,88 @@ class Client(object):
             server_messages.reconfigure(encoding='ASCII')
         
         # Client returns raw data from the server
-        configuration = Client.parse_level(server_messages)
+        configuration = Client.parse_level(server_messages, options)
         
         __debug_msg = 'Initializing controller...'
         print(__debug_msg, file=sys.stderr, flush=True)
         log.debug(__debug_msg)
         
         controller = Controller(configuration)
-        controller.deploy()
+        profiling.deploy(controller, configuration)
         sys.exit(0)
                 
     @staticmethod
-    def send_to_server(actions: [['Actions', ...], ...]) -> None:
+    def open_stream() -> ActionStream:
+        """Stream to send actions to the server without waiting for its responses.
+        """
+        return ActionStream(sys.stdin, sys.stdout)
+    
+    @staticmethod
+    def parse_response(response: str, num_agents: int) -> [bool, ...]:
+        """Whether the action of each agent succeeded, from a server response
+        such as "true|false". A single value stands for every agent.
+        """
+        values = [v.strip() == 'true' for v in response.strip().strip('[]').replace(',', '|').split('|')]
+
+        if len(values) == 1:
+            return values * num_agents
+        return values
+
+    @staticmethod
+    def send_to_server(actions: [['Actions', ...], ...], on_failure=None, lookahead: int = None) -> bool:
         """Send actions to the server. Must be already formatted.
+
+        Up to lookahead joint actions are sent before waiting for the server responses,
+        which hides the round trip. When the server rejects an action, nothing more is
+        sent until the responses to the joint actions already sent are in. Then on_failure
+        (if given) is called with the joint actions sent so far, the per-agent results
+        of each of them and the joint actions not sent yet. It returns the joint actions
+        to send instead of the latter, or None to go on with them.
+
+        Returns:
+            bool: whether every action was accepted
         """
         server_messages = sys.stdin
-            
-        for joint_action in actions:
-            print("|".join(a.name_ for a in joint_action), flush=True)
+        lookahead = lookahead or Client.LOOKAHEAD
+        pending = deque(actions)
+        sent = []
+        results = []
+        accepted = True
+        repairs = 0
+
+        while pending or len(results) < len(sent):
+            # Keep the look-ahead buffer full, unless an action failed
+            while pending and len(sent) - len(results) < lookahead and \
+                    (accepted or len(results) == len(sent)):
+                joint_action = pending.popleft()
+                print("|".join(a.name_ for a in joint_action), flush=True)
+                sent.append(joint_action)
+
+            if len(results) == len(sent):
+                continue
+
             # We must read the server's response to not fill up the stdin buffer and block the server.
             response = server_messages.readline()
+
+            if not response:
+                log.error("Server closed the connection after %d joint actions.", len(results))
+                return False
+
+            result = Client.parse_response(response, len(sent[len(results)]))
+            results.append(result)
+
+            if not all(result) and accepted:
+                accepted = False
+                log.debug("Joint action %d rejected by the server: %s.", len(results) - 1, response.strip())
+
+            # Every response to what was sent is in: the world state is known again
+            if not accepted and len(results) == len(sent):
+                if on_failure and repairs < Client.MAX_REPAIRS:
+                    repairs += 1
+                    repaired = on_failure(sent, results, list(pending))
+
+                    if repaired is not None:
+                        pending = deque(repaired)
+                accepted = True
+
+        return all(all(result) for result in results)
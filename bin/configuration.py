@@ -8,7 +8,8 @@ from goal import Goal
 from agent import Agent
 from level import Level
 from color import Color
-from location import Location
+from distance import DistanceTable
+from movetable import MoveTable
 from enum import Enum, unique
 
 
@@ -21,8 +22,62 @@ class StrategyType(Enum):
     AGENTS = 1
 
 
+# Client options (see main.py for the command line flags)
+DEFAULT_OPTIONS = {
+    # Distance table: 'eager' computes all rows at start up, 'lazy' on first use,
+    # 'auto' is lazy for very large levels only
+    'distances': 'auto',
+    # Maximum number of routes kept by the route cache (0 disables it)
+    'route_cache': 4096,
+    # Worker processes expanding states in the state search (1 expands in the client process)
+    'workers': 1,
+    # State search engine: 'joint' expands every agent at once, 'decomposition' one agent
+    # at a time (operator decomposition) and plans independent agents apart
+    'search': 'joint',
+    # Planner: 'greedy' plans agents one after the other and makes them wait for each
+    # other, 'cbs' plans all of them at once with Conflict-Based Search
+    'planner': 'greedy',
+    # Routes of the greedy planner: 'independent' routes made to wait for each other
+    # afterwards, or 'cooperative' ones planned around the cells reserved by other agents
+    'routes': 'independent',
+    # Send joint actions while planning goes on, reading the server responses in the background
+    'stream': False,
+    # Memory budget of the state search in MB (None for no budget)
+    'memory': None,
+    # What the joint state search does once over the memory budget: 'beam' drops the
+    # worst states of the frontier, 'ida' starts over with IDA* (memory linear in depth)
+    'bounded': 'beam',
+    # Seconds every joint state search may spend improving its plan (anytime search, ARA*),
+    # None to return the first plan found. The first plan is searched with the given weight.
+    'anytime': None,
+    'weight': 5.0,
+    # Search metrics (see SearchMetrics): JSON-lines file, or callable taking every record
+    # (None for neither), and minimum seconds in between two progress records
+    'metrics': None,
+    'metrics_interval': 1.0,
+    # Profiling (see profiling.py): directory of the per-level reports (None for no profiling),
+    # and allocating lines reported per state search (0 for no allocation tracing)
+    'profile': None,
+    'profile_memory': 0,
+}
+
+
 class Configuration(object):
-    def __init__(self, raw_data: dict):
+    def __init__(self, raw_data: dict, options: dict = None):
+        """
+        Args:
+            raw_data (dict): level as parsed by Client.parse_level. Walls, boxes and goals
+            are (rows, cols) uint8 arrays: 1 for walls, the character code of box
+            letters and goal letters/digits, 0 elsewhere.
+            options (dict, optional): client options (see DEFAULT_OPTIONS)
+        """
+        
+        # Client options
+        self.__options = dict(DEFAULT_OPTIONS)
+        self.__options.update(options or {})
+        
+        # Level name (#levelname)
+        self.__name = raw_data.get('name')
         
         # Configuration type: only agents? boxes?
         self.__type = StrategyType.AGENTS
@@ -42,6 +97,14 @@ class Configuration(object):
         self.__raw_goals = raw_data['goals']
 
         
+    @property
+    def options(self) -> dict:
+        return self.__options
+    
+    @property
+    def name(self) -> str:
+        return self.__name
+        
     @property
     def strategy_type(self):
         """The type of challenge we are dealing with.
@@ -65,23 +128,21 @@ class Configuration(object):
         _raw_goals = self.__raw_goals
         _goals = {}
         
-        for row in range(1, self.level_row_cnt - 1):
-            for col in range(1, self.level_col_cnt - 1):
-                gl_label = _raw_goals[row][col]
-                
-                if gl_label:
-                    loc = level.get_location((row, col), translate=True)
-                    
-                    if 'A' <= gl_label <= 'Z':
-                        color = Color(self.__raw_box_colors[ord(gl_label) - ord('A')])
-                    elif '0' <= gl_label <= '9':
-                        color = Color(self.__raw_agent_colors[ord(gl_label) - ord('0')])
-                    else:
-                        raise Exception('Unsupported type of goal.')
-                    
-                    _goals.update({
-                        loc: Goal(gl_label, loc, color)
-                    })
+        # Goals inside the outer walls, row by row
+        for row, col in (np.argwhere(_raw_goals[1:-1, 1:-1]) + 1).tolist():
+            gl_label = chr(_raw_goals[row, col])
+            loc = level.get_location((row, col), translate=True)
+            
+            if 'A' <= gl_label <= 'Z':
+                color = Color(self.__raw_box_colors[ord(gl_label) - ord('A')])
+            elif '0' <= gl_label <= '9':
+                color = Color(self.__raw_agent_colors[ord(gl_label) - ord('0')])
+            else:
+                raise Exception('Unsupported type of goal.')
+            
+            _goals.update({
+                loc: Goal(gl_label, loc, color)
+            })
 
         log.debug("Finished goals.")
         return _goals
@@ -116,80 +177,41 @@ class Configuration(object):
         
         _boxes = np.array([])
         
-        for row in range(1, self.level_row_cnt - 1):
-            for col in range(1, self.level_col_cnt - 1):
-                p_box = _box_positions[row][col]
-                
-                if p_box:
-                    c_box = ord(p_box) - ord('A')
-                    b_color = _box_colors[c_box]
-                    b_loc = level.get_location((row, col), translate=True)
-                    _boxes = np.append(_boxes, Box(p_box, b_loc, b_color))
-                    
+        # Boxes inside the outer walls, row by row
+        for row, col in (np.argwhere(_box_positions[1:-1, 1:-1]) + 1).tolist():
+            p_box = chr(_box_positions[row, col])
+            c_box = ord(p_box) - ord('A')
+            b_color = _box_colors[c_box]
+            b_loc = level.get_location((row, col), translate=True)
+            _boxes = np.append(_boxes, Box(p_box, b_loc, b_color))
+            
         log.debug("Finished boxes.")
         return _boxes
         
     def __build_level(self):
-        """Builds an adjacent list with locations and its neighbors
+        """Builds the level: wall mask, neighbors and distances of every cell
         """
         log.debug("Building level...")
         
-        raw_walls = self.__raw_walls
-        self.level_row_cnt = row_cnt = len(raw_walls)
-        self.level_col_cnt = col_cnt = len(raw_walls[0])
-        corners = []
-        
-        # Ignoring out of bound walls
-        #
-        # Symmetric matrix with locations
-        # this, however, infers storing a lot of walls in certain maps, such as MAbispebjerg.lvl
-        #
-        layout = np.array([
-            [Location(row, col) for col
-             in range(1, col_cnt - 1)] for row in range(1, row_cnt - 1)
-        ], dtype=object)
-        
-        # for each row
-        for entries in layout:
-            # for loc in each col
-            for loc in entries:
-                crow = loc.row
-                ccol = loc.col
-                loc.is_wall = raw_walls[crow][ccol]  # Whether location is wall
-                
-                if not loc.is_wall:
-                    # PRE-COMPUTED DISTANCES
-                    loc.build_distance_array(row_cnt, col_cnt)
-                    
-                    # NEIGHBORS
-                    # Possible neigbohood locations
-                    positions = (
-                        (crow + 1, ccol),  # north
-                        (crow - 1, ccol),  # south
-                        (crow, ccol + 1),  # east
-                        (crow, ccol - 1),  # west
-                    )
-
-                    # Positions in the location array start from 0
-                    # Ignoring walls
-                    try:
-                        loc.neighbors = [
-                            layout[nrow-1][ncol-1] for nrow, ncol in positions if not raw_walls[nrow][ncol]
-                        ]
-                    except IndexError:
-                        pass
-                    
-                    # Compute the corners for the level
-                    if loc.is_corner():
-                        corners.append(loc)
+        self.level_row_cnt, self.level_col_cnt = row_cnt, col_cnt = self.__raw_walls.shape
+        
+        # Outside walls are always walls
+        walls = np.ones((row_cnt, col_cnt), dtype=bool)
+        walls[1:-1, 1:-1] = self.__raw_walls[1:-1, 1:-1] != 0
+        
+        # True distances (BFS over walls) in between all free cells
+        distances = DistanceTable(walls, lazy={
+            'eager': False, 'lazy': True
+        }.get(self.__options['distances']))
         
         log.debug("Finished levels.")
-        return Level(layout, row_cnt, col_cnt, corners)
+        return Level(walls, distances)
     
     def build_structure(self):
         log.debug("Building overall structure...")
         
         __level = self.__build_level()
+        __level.moves = MoveTable(__level.walls, __level.num_rows, __level.num_cols)
         __agents = self.__build_agents(__level)
         __boxes = self.__build_boxes(__level)
         __goals = self.__build_goals(__level)
@@ -1,17 +1,29 @@
 import sys
+import time
 import memory
+import profiling
 import client
 import logging
 import numpy as np
 
 from queue import PriorityQueue
 
-from copy import deepcopy
-from eprint import deb
-
 from box import Box
 from goal import Goal
-from state import State
+from state import State, StateContext
+from simulator import Simulator
+from frontier import Frontier
+from transposition import TranspositionTable
+from metrics import SearchMetrics
+from bounded import IterativeDeepeningSearch
+from assignment import GoalAssignment
+from allocation import TaskAllocator
+from anytime import AnytimeSearch
+from routecache import RouteCache
+from parallel import ParallelExpander
+from decomposition import DecompositionSearch, GroupPlanner
+from cbs import ConflictBasedSearch
+from reservation import ReservationTable
 from agent import Agent
 from level import Level
 from action import Action
@@ -26,13 +38,63 @@ globals().update(Action.__members__)
 
 
 class Controller(object):
+    REJOIN_STEPS = 10  # Steps of the plan a repair may take to catch up with it
+    BOUNDED_KEEP = 0.5  # Share of the search nodes kept once over the memory budget
+    IDA_BUDGET = 30.0  # Seconds an IDA* state search may take (see __ida_search)
+    
     def __init__(self, configuration: Configuration):
         print('Controller initialized.', file=sys.stderr, flush=True)
         log.debug('Controller initialized.')
         
         self.__parse_config__(configuration)
-        self.__cached_routes = {}
+        self.__route_cache = RouteCache(configuration.options['route_cache'])
+        self.__assignment = GoalAssignment(self.__level, self.__goals)
+        self.__allocator = TaskAllocator(self.__level)
+        self.__workers = configuration.options['workers']
+        self.__search = configuration.options['search']
+        self.__planner_type = configuration.options['planner']
+        
+        # Memory budget (--memory) and what the state search does when over it (--bounded)
+        memory.set_max_usage(configuration.options['memory'])
+        self.__bounded = configuration.options['bounded']
+        
+        # Anytime state search (--anytime): time budget and first weight
+        self.__anytime = configuration.options['anytime']
+        self.__weight = configuration.options['weight']
+        
+        # Cooperative routes (--routes cooperative): cells taken by the agents already planned
+        self.__cooperative = configuration.options['routes'] == 'cooperative'
+        self.__reservations = ReservationTable()
+        
+        # Streaming (--stream): joint actions are sent as soon as no agent plan can change them.
+        # Only cooperative routes are never changed once planned (independent ones get waits
+        # inserted in front of them), so otherwise the plan goes out through send_to_server.
+        stream = configuration.options['stream'] and self.__cooperative
+        self.__stream = client.Client.open_stream() if stream else None
+        self.__streamed = 0  # Joint actions of the agent plans sent so far
+        self.__sent = []  # Joint actions sent through the stream, repairs included
+        
+        if configuration.options['stream'] and not stream:
+            log.debug("Nothing can be streamed early without cooperative routes, plan sent when done.")
+        
         self.__rev_cnfs = {a: [] for a in self.__agents}
+        
+        # Agent in charge of every box, by id() of the box (see __allocate_boxes)
+        self.__owners = {}
+        
+        # Counters, timers and memory of all the state searches (--metrics), see SearchMetrics
+        sink = configuration.options['metrics']
+        self.metrics = SearchMetrics(
+            path=None if callable(sink) else sink,
+            callback=sink if callable(sink) else None,
+            interval=configuration.options['metrics_interval']
+        )
+        
+        # Planner time per desire: (agent, desire, seconds), see __state_search
+        self.desire_times = []
+        
+        # Plans repaired after rejected actions (see __repair)
+        self.repairs = 0
     
     def __parse_config__(self, configuration: Configuration):
         """Parses Configuration into data structure with objects
@@ -55,29 +117,98 @@ class Controller(object):
 
         # @ATTENTION: DO NOT CHANGE THE ORDERING BELOW
                 
-        # 1) First we find destination for the boxes
-        for box in self.__boxes:
-            _d = self.__destination_for_box(box)
-            box.destination = self.__destination_for_box(box)
+        # 1) First we find destination for the boxes, all boxes of a letter at once
+        for box, _d in self.__assignment.assign(self.__boxes):
+            box.destination = _d
             if _d: box.update_route(self.__find_route(box.location, _d))
             
         # 2) Based on 1, we find goals for the agents
-        for agent in self.__agents:
-            agent.goals = self.__goal_for_agent(agent)
+        if self.__strategy == StrategyType.AGENTS:
+            for agent in self.__agents:
+                agent.goals = self.__goal_for_agent(agent)
+        else:
+            self.__allocate_boxes()
         
         log.debug("Finished initial destinations.")
             
-    def get_box_owner(self, box: 'Box') -> 'Agent':
+    def __allocate_boxes(self, colors=None, loads=None):
+        """Share the boxes with a destination out among the agents of their color (see TaskAllocator)
+        and make them the agent goals.
+        
+        Args:
+            colors (optional): only these colors, with the boxes still in the goals of their agents
+            loads (dict, optional): agent: time steps it is busy for already
+        """
+        for color in dict.fromkeys(agent.color for agent in self.__agents):
+            if colors is not None and color not in colors:
+                continue
+            
+            agents = [agent for agent in self.__agents if agent.color == color]
+            
+            if colors is None:
+                boxes = [box for box in self.__boxes if box.destination and box.color == color]
+            else:
+                boxes = [box for agent in agents for box in agent.goals]
+            
+            _loads = [loads.get(agent, 0) for agent in agents] if loads else None
+            
+            for agent, tasks in zip(agents, self.__allocator.allocate(agents, boxes, _loads)):
+                agent.goals = tasks
+                
+                for box in tasks:
+                    self.__owners[id(box)] = agent
+    
+    def __rebalance(self):
+        """Share the boxes not started yet out again when an agent is done while
+        others of its color still have more than one box to move.
+        """
+        if self.__strategy == StrategyType.AGENTS:
+            return
+        
+        colors = set()
+        for agent in self.__agents:
+            if agent.has_sleep_desire() and any(
+                len(other.goals) > 1 for other in self.__agents if other.color == agent.color
+            ):
+                colors.add(agent.color)
+        
+        if not colors:
+            return
+        
+        # Agents are busy until the end of their plan, plus what their current box takes
+        loads = {}
         for agent in self.__agents:
-            if agent.color == box.color:
-                return agent
+            loads[agent] = len(agent.actions)
+            
+            if agent.desire and agent.desire.is_box_desire():
+                box = agent.desire.element
+                loads[agent] += agent.distance(box.location) + box.location.distance(box.destination)
+        
+        self.__allocate_boxes(colors, loads)
+        
+        log.debug('Boxes shared out again among agents of colors %s.', colors)
+    
+    def get_box_owner(self, box: 'Box') -> 'Agent':
+        """Agent in charge of the box (see __allocate_boxes), or the closest agent of its color.
+        """
+        owner = self.__owners.get(id(box))
+        if owner is not None:
+            return owner
+        
+        candidates = [agent for agent in self.__agents if agent.color == box.color]
+        if candidates:
+            return min(candidates, key=lambda agent: agent.distance(box.location))
         
         __err = '%s has no owner (?).' % box
         log.error(__err)
         raise Exception(__err)
     
     def __adapt_level(self, agent: 'Agent', conflicts=None):
-        """Copy and modify the level according to the route.
+        """Level and actors of the state search for the agent desire.
+        The level is shared (see LevelOverlay): nothing is copied, and the search
+        does not change the actors it is given (see State.extract_actors).
+        Actors left out of the search are obstacles in the overlay only, but for those
+        on the cell of an actor of the search (routes go through boxes, see __find_route).
         """
         __a = {agent, }
         __b = {agent.desire.element, } if agent.desire.is_box_desire() else set()
@@ -86,9 +217,15 @@ class Controller(object):
             __a = __a.union(conflicts[0])
             __b = __b.union(conflicts[1])
         
-        _level = self.__level.clone()
-        _agents = deepcopy(np.array(list(__a)))
-        _boxes = deepcopy(np.array(list(__b)))
+        _level = self.__level.overlay()
+        _cells = {self.__level.index_of(actor.location) for actor in __a.union(__b)}
+        for actor in list(self.__agents) + list(self.__boxes):
+            cell = self.__level.index_of(actor.location)
+            if actor not in __a and actor not in __b and cell not in _cells:
+                _level.block(cell)
+        
+        _agents = np.array(list(__a))
+        _boxes = np.array(list(__b))
         _goals = self.__goals
         return _level, _agents, _boxes, _goals
     
@@ -112,10 +249,12 @@ class Controller(object):
                 conflicts = True
                 
                 if delay_plan:
+                    # Joint actions already streamed cannot be delayed anymore
                     _oplan = other_agent.actions
                     other_agent.clear_actions(keep_route=True)
-                    plan = [Action.NoOp for _ in range(len(agent.current_route))]
-                    plan.extend(_oplan)
+                    plan = _oplan[:self.__streamed]
+                    plan.extend(Action.NoOp for _ in range(len(agent.current_route)))
+                    plan.extend(_oplan[self.__streamed:])
                 else:
                     plan = [Action.NoOp, ]
                     
@@ -148,9 +287,7 @@ class Controller(object):
                 else:
                     _m.append(_a)
                     
-                __debug_msg = 'Actor %s found on route %s.' % (_a, route)
-                print(__debug_msg, file=sys.stderr, flush=True)
-                log.debug(__debug_msg)
+                log.debug('Actor %s found on route %s.', _a, route)
         return {agent: _m}
     
     def __is_location_in_route(self, location: Location):
@@ -226,7 +363,7 @@ class Controller(object):
                     owner = self.get_box_owner(_o)
                     
                     if not _o.destination:
-                        _o.destination = new_loc
+                        _o.destination = self.__destination_for_box(_o) or new_loc
 
                     owner.reschedule_desire(_o)  # update_desire gets called inside
                     owner.update_route(self.__find_route(owner.location, owner.desire.location))
@@ -238,9 +375,7 @@ class Controller(object):
                         # Waits for: length of the current path  plus the sum of row and col (at destination)
                         self.__make_agent_wait(owner, _af, len(owner.current_route) + (_o.location.row + _o.location.col))
                     
-                    __debug_msg = 'Rescheduling desire for Agent %s. New desire is %s.' % (owner.identifier, owner.desire)
-                    print(__debug_msg, file=sys.stderr, flush=True)
-                    log.debug(__debug_msg)
+                    log.debug('Rescheduling desire for Agent %s. New desire is %s.', owner.identifier, owner.desire)
                 else:
                     # The conflict is another agent
                     # Create a goal and send it away
@@ -265,48 +400,171 @@ class Controller(object):
         """State space for current agent's plan
         """
 
-        frontier = PriorityQueue()
+        initial = State.from_actors(level, agents, boxes, goals)
+        self.metrics.searches += 1
+        profiling.snapshot('state search %d' % self.metrics.searches)
+        
+        try:
+            return self.__search_from(initial)
+        finally:
+            self.metrics.counters['deadlocks'] += initial.context.deadlocks
+            self.metrics.measure()
+            self.metrics.emit('search')
+    
+    def __search_from(self, initial: State):
+        """Plan from the initial state with the configured state search.
+        """
+        if self.__search == 'decomposition':
+            search = DecompositionSearch(initial)
+            state = search.solve()
+            
+            log.debug('Decomposition search nodes: %s.', search.nodes)
+            self.__count_nodes(search.nodes)
+            return state.extract_actors(), state.extract_actions()
+        
+        if self.__anytime is not None:
+            return self.__anytime_search(initial)
+        
+        found = self.__best_first_search(initial)
+        
+        # Over the memory budget with --bounded ida: IDA* starts once nothing of the search above is kept
+        if found is None:
+            return self.__ida_search(initial)
+        return found
+    
+    def __best_first_search(self, initial: State):
+        """Greedy best-first search, kept within the memory budget (see --bounded).
+        
+        Returns:
+            tuple: actors and actions of the plan, or None when over the memory budget with --bounded ida
+        """
+        frontier = Frontier()
         iterations = 0
+        counters = self.metrics.counters
+        timers = self.metrics.timers
         # frontier = set of all leaf nodes available for expansion
-        frontier.put((0, State(level, agents, boxes, goals)))
-        explored = set()
+        frontier.put(0, initial)
+        explored = TranspositionTable()
         
-        while True:
-
-            iterations += 1
-            if iterations % 50 == 0:
-                memory.print_search_status(explored, frontier)
-
-            if memory.get_usage() > memory._max_usage:
-                memory.print_search_status(explored, frontier)
-                deb('Maximum memory usage exceeded.')
-                return None
-
-            # if the frontier is empty then return failure
-            if frontier.empty():
-                __err = "Could not solve conflicts. Problem infeasible?"
-                log.error(__err)
-                raise Exception(__err)
-
-            # choose a leaf node and remove it from the frontier
-            _, state = frontier.get()
-
-            # if the node contains a goal state then return the corresponding solution
-            if state.is_goal_state():
-                return state.extract_actors(), state.extract_actions()
+        # Worker pool (--workers), only started once the frontier can keep it busy
+        expander = None
+        
+        # Nodes the search may keep, set when the memory budget is first exceeded
+        max_nodes = None
+        
+        try:
+            while True:
 
-            # add the node to the explored set
-            explored.add(state)
-            
-            # expand the chosen node, adding the resulting nodes to the frontier
-            # only if not in the frontier or explored set
-            expanded = state.get_expanded_states()
+                iterations += 1
+                self.metrics.sample(iterations)
 
-            for n in expanded:
-                rnode = n.h, n
-                if not (rnode in frontier.queue or n in explored):
-                    frontier.put(rnode)
+                # The process memory does not shrink when nodes are dropped: once over
+                # the budget, the search keeps to a number of nodes instead
+                if max_nodes is None and memory.is_over_budget(iterations):
+                    log.debug(
+                        'Maximum memory usage exceeded: %d explored, %d in the frontier.', len(explored), len(frontier)
+                    )
                     
+                    if self.__bounded == 'ida':
+                        return None
+                    max_nodes = max(1, int(Controller.BOUNDED_KEEP * (len(frontier) + len(explored))))
+                
+                if max_nodes is not None and len(frontier) + len(explored) > max_nodes:
+                    if len(explored) > max_nodes // 2:
+                        explored.clear()
+                    # Down to half of what is left, so that pruning does not come back every iteration
+                    dropped = frontier.prune(max(1, (max_nodes - len(explored)) // 2))
+                    log.debug("Memory budget: %d states dropped from the frontier.", dropped)
+
+                # if the frontier is empty then return failure
+                if frontier.empty():
+                    __err = "Could not solve conflicts. Problem infeasible?"
+                    log.error(__err)
+                    raise Exception(__err)
+
+                if expander is None and self.__workers > 1 and \
+                        len(frontier) >= self.__workers * ParallelExpander.CHUNK_SIZE:
+                    expander = ParallelExpander(initial.context, self.__workers)
+
+                # choose a leaf node (a batch of them in parallel mode) and remove it from the frontier
+                batch = [frontier.get()[1]]
+                
+                if expander:
+                    while frontier and len(batch) < expander.batch_size:
+                        batch.append(frontier.get()[1])
+
+                for state in batch:
+                    # if the node contains a goal state then return the corresponding solution
+                    if state.is_goal_state():
+                        log.debug('Joint search: %d iterations, metrics %s.', iterations, counters)
+                        return state.extract_actors(), state.extract_actions()
+
+                    # add the node to the explored set
+                    explored.add(state)
+                    counters['expanded'] += 1
+                
+                # expand the chosen nodes, adding the resulting nodes to the frontier
+                # only if not in the frontier or explored set
+                start = time.perf_counter()
+                if expander:
+                    expanded = expander.expand(batch)
+                else:
+                    expanded = [state.get_expanded_states() for state in batch]
+                timers['expansion'] += time.perf_counter() - start
+
+                for successors in expanded:
+                    start = time.perf_counter()
+                    fresh = [n for n in successors if n not in explored]
+                    hashed = time.perf_counter()
+                    priorities = [n.h for n in fresh]
+                    timers['hashing'] += hashed - start
+                    timers['heuristic'] += time.perf_counter() - hashed
+                    
+                    counters['generated'] += len(successors)
+                    counters['duplicates'] += len(successors) - len(fresh)
+                    
+                    # Already queued states are only updated if the new path is cheaper
+                    for h, n in zip(priorities, fresh):
+                        frontier.put(h, n)
+        finally:
+            if expander:
+                expander.shutdown()
+                    
+    def __count_nodes(self, nodes: dict):
+        for count in ('expanded', 'generated'):
+            self.metrics.counters[count] += nodes.get(count, 0)
+    
+    def __anytime_search(self, initial: State):
+        """Best plan found within the time budget, see AnytimeSearch.
+        """
+        search = AnytimeSearch(initial, self.__anytime, self.__weight)
+        state = search.solve()
+        
+        log.debug('Anytime search nodes: %s.', search.nodes)
+        self.__count_nodes(search.nodes)
+        
+        if state is None:
+            __err = "Could not solve conflicts. Problem infeasible?"
+            log.error(__err)
+            raise Exception(__err)
+        return state.extract_actors(), state.extract_actions()
+    
+    def __ida_search(self, initial: State):
+        """State search in memory linear in the plan length, see IterativeDeepeningSearch.
+        It gives up after Controller.IDA_BUDGET seconds.
+        """
+        search = IterativeDeepeningSearch(initial, budget=Controller.IDA_BUDGET)
+        state = search.solve()
+        
+        log.debug('IDA* search nodes: %s.', search.nodes)
+        self.__count_nodes(search.nodes)
+        
+        if state is None:
+            __err = "Could not solve conflicts. Problem infeasible?"
+            log.error(__err)
+            raise Exception(__err)
+        return state.extract_actors(), state.extract_actions()
+    
     def __agent_scheduler(self):
         """Define agents order in plan execution.
         Agents with furthest objectives are put further down the queue        
@@ -333,7 +591,62 @@ class Controller(object):
             
         return _ord_agts
         
+    def __cbs_planner(self) -> bool:
+        """Plan every agent at once with Conflict-Based Search and send the plan to the server.
+        Agents must reach their level goals and boxes their destinations.
+
+        Returns:
+            bool: whether a plan was found
+        """
+        __debug_msg = 'CBS planner initialized.'
+        print(__debug_msg, file=sys.stderr, flush=True)
+        log.debug(__debug_msg)
+        
+        targets = [None for _ in self.__agents]
+        for n, agent in enumerate(self.__agents):
+            for loc, goal in self.__goals.items():
+                if goal.identifier == agent.identifier:
+                    targets[n] = loc
+        
+        initial = State.from_actors(self.__level, self.__agents, self.__boxes, self.__goals, targets)
+        search = ConflictBasedSearch(initial)
+        state = search.solve()
+        
+        __debug_msg = 'CBS nodes: %s.' % search.nodes
+        print(__debug_msg, file=sys.stderr, flush=True)
+        log.debug(__debug_msg)
+        self.__count_nodes(search.nodes)
+        
+        if state is None:
+            return False
+        
+        # Joint actions are in the same order as the agents
+        plan = [tuple(acts.values()) for acts in state.extract_actions()]
+        state_agents, state_boxes = state.extract_actors()
+        
+        for n, (agent, _agent) in enumerate(zip(self.__agents, state_agents)):
+            agent.update_actions([joint_action[n] for joint_action in plan])
+            agent.move(_agent.location)
+        
+        for box, _box in zip(self.__boxes, state_boxes):
+            box.move(_box.location)
+        
+        __debug_msg = 'Sending final plan to server...'
+        log.debug(__debug_msg)
+        print(__debug_msg, file=sys.stderr, flush=True)
+        
+        self.__send(self.__assemble())
+        return True
+        
     def __planner(self):
+        if self.__planner_type == 'cbs':
+            if self.__cbs_planner():
+                return
+            
+            __debug_msg = 'CBS found no plan, falling back to the greedy planner.'
+            print(__debug_msg, file=sys.stderr, flush=True)
+            log.debug(__debug_msg)
+        
         __debug_msg = 'Planner initialized.'
         print(__debug_msg, file=sys.stderr, flush=True)
         log.debug(__debug_msg)
@@ -342,22 +655,33 @@ class Controller(object):
         agents = self.__agent_scheduler()
         agents_desire = True
         
+        if self.__cooperative:
+            # Boxes stand where they are until an agent moves them. Agents not planned
+            # yet are ignored, they go around the others when their turn comes
+            for box in self.__boxes:
+                self.__reservations.rest(self.__level.index_of(box.location), 0, id(box))
+        
         while agents_desire:
             to_move = {}
+            uncoordinated = False  # Whether an agent got a route that ignores the others
+            
+            # No plan starts before the shortest one so far
+            self.__reservations.advance(min(len(agent.actions) for agent in agents))
             
             for agent in agents:
+                # Where the plan of this agent starts (see __reserve_actions)
+                start_time = len(agent.actions)
+                start_cell = self.__level.index_of(agent.location)
+                box_cells = {self.__level.index_of(box.location): box for box in self.__boxes}
+                
                 # Create desire from the goals
                 agent.update_desire()
                 
-                __debug_msg = 'Desire for Agent %s is %s.' % (agent.identifier, agent.desire)
-                log.debug(__debug_msg)
-                print(__debug_msg, file=sys.stderr, flush=True)
+                log.debug('Desire for Agent %s is %s.', agent.identifier, agent.desire)
 
                 if not agent.desire.is_sleep_desire():
-                    log.debug("%s is awake! Desire is %s." % (agent, agent.desire))
-                    __debug_msg = 'Creating preliminary route for Agent %s...' % agent.identifier
-                    log.debug(__debug_msg)
-                    print(__debug_msg, file=sys.stderr, flush=True)
+                    log.debug("%s is awake! Desire is %s.", agent, agent.desire)
+                    log.debug('Creating preliminary route for Agent %s...', agent.identifier)
                     
                     destination = agent.desire.location
                     agent.update_route(self.__find_route(agent.location, destination))
@@ -365,12 +689,19 @@ class Controller(object):
                     # Check whether something is on this route and add to solve it later
                     to_move.update(self.__route_sweeper(agent, agent.current_route, ignore={agent, }))
                     
-                    log.debug("Route for %s is %s and desire is %s " % (agent, agent.current_route, agent.desire))
+                    log.debug("Route for %s is %s and desire is %s ", agent, agent.current_route, agent.desire)
 
                     # If obstructions exist, change desires, moving agent priorities
                     self.__check_obstructions(to_move)
                     
-                    actions = Controller.generate_move_actions(agent.current_route)
+                    actions = None
+                    if self.__cooperative:
+                        # Next to the box for box desires (see Agent.update_route), the box cell is reserved
+                        actions = self.__cooperative_actions(agent, agent.desire.location)
+                    
+                    if actions is None:
+                        actions = Controller.generate_move_actions(agent.current_route)
+                        uncoordinated = True
                     # Checkinf conflicts before generating actions
                     agent.update_actions(actions)
                                     
@@ -380,23 +711,22 @@ class Controller(object):
                         actions
                     )
                     
-                    __debug_msg = "Moving %s to %s." % (agent, last_loc)
-                    log.debug(__debug_msg)
-                    print(__debug_msg, file=sys.stderr, flush=True)
+                    log.debug("Moving %s to %s.", agent, last_loc)
                     
                     agent.move(last_loc)  # location nearby box
                     agent.update_desire()
                     
-                    __debug_msg = "Performing state search..."
-                    log.debug(__debug_msg)
-                    print(__debug_msg, file=sys.stderr, flush=True)
+                    log.debug("Performing state search...")
                     
-                    list_actors, list_actions = self.__state_search(*self.__adapt_level(agent))
+                    _start = time.perf_counter()
+                    _level, _agents, _boxes, _goals = self.__adapt_level(agent)
+                    list_actors, list_actions = self.__state_search(_level, _agents, _boxes, _goals)
+                    self.desire_times.append((agent, agent.desire, time.perf_counter() - _start))
+                    
+                    log.debug("State search for %s took %.3fs.", agent.desire, self.desire_times[-1][2])
                     state_agents, state_boxes = list_actors
                                     
-                    __debug_msg = "Extracting actions..."
-                    log.debug(__debug_msg)
-                    print(__debug_msg, file=sys.stderr, flush=True)
+                    log.debug("Extracting actions...")
                     
                     # Extracting actions
                     agt_actions = []
@@ -412,23 +742,31 @@ class Controller(object):
                                 agt.add_to_route(a.location)
                                 agt.move(a.location)
                                 agent.update_desire()
-                                log.debug("%s moved to %s." % (agt, agt.location))
+                                log.debug("%s moved to %s.", agt, agt.location)
 
+                    if self.__cooperative:
+                        agt_actions = self.__delay_actions(agent, agt_actions, box_cells)
+                    
                     agent.update_actions(agt_actions)
-                    log.debug('%s new route is %s with actions %s.' % (
-                        agent,
-                        agent.current_route,
-                        agent.actions
-                    ))
+                    log.debug('%s new route is %s with actions %s.', agent, agent.current_route, agent.actions)
                     
-                    # Updating locations from actions received from state
-                    for b in state_boxes:
-                        for box in self.__boxes:
-                            if b.equals(box):
-                                box.move(b.location)
-                                log.debug("%s moved to %s." % (box, box.location))
-                                
-            self.__check_route_conflicts()
+                    # Updating locations from actions received from state. Boxes come back
+                    # in the order they were given: boxes of the same letter share identifiers
+                    for box, b in zip(_boxes, state_boxes):
+                        box.move(b.location)
+                        log.debug("%s moved to %s.", box, box.location)
+                
+                if self.__cooperative:
+                    self.__reserve_actions(agent, start_cell, start_time, agent.actions[start_time:], box_cells)
+            
+            # Cooperative routes are already free of conflicts, the routes they fall back to are not
+            if not self.__cooperative or uncoordinated:
+                self.__check_route_conflicts()
+            
+            self.__send_committed()
+            
+            # Agents done early take over boxes from the busy ones
+            self.__rebalance()
             
             # Are agents satisfied?
             agents_desire = sum([not agent.desire.is_sleep_desire() for agent in agents])
@@ -438,8 +776,311 @@ class Controller(object):
         print(__debug_msg, file=sys.stderr, flush=True)
         
         self.__equalize_actions()
-        client.Client.send_to_server(self.__assemble())
+        if self.__sequence_actions():
+            self.__equalize_actions()
+        self.__send(self.__assemble()[self.__streamed:])
+    
+    def __sequence_actions(self, end=None):
+        """Make agents wait where the server would reject their action (see Simulator).
+        
+        Routes are planned independently and only checked against each other (see
+        __check_route_conflicts), not against the boxes moved by the other agents, so an
+        agent may come by before the cell it needs is free. Such an agent waits a step
+        before its action instead; of agents failing together only the first one tries
+        again at the next step. The plan is kept as it is if the agents would wait for
+        longer than the plan itself (e.g. for each other).
+        
+        Only the joint actions not sent yet are changed, up to end (all of them by default,
+        once the plan is equalized).
+        
+        Returns:
+            bool: False if the plan was kept as it is with actions the server would reject
+        """
+        actions = [list(agent.actions) for agent in self.__agents]
+        end = max(len(acts) for acts in actions) if end is None else end
+        plan = [[acts[t] if t < len(acts) else Action.NoOp for acts in actions] for t in range(end)]
+        
+        results = Simulator.from_state(self.__initial, self.__goals).run(plan)
+        failing = np.flatnonzero(~results[self.__streamed:].all(axis=1))
+        
+        if not len(failing):
+            return True
+        
+        # The world as it is before the first action the server would reject
+        start = self.__streamed + int(failing[0])
+        world = Simulator.from_state(self.__initial, self.__goals)
+        world.run(plan[:start])
+        
+        waits = 0
+        for t in range(start, end):
+            joint_action = [acts[t] if t < len(acts) else Action.NoOp for acts in actions]
+            failed = [n for n, ok in enumerate(world.step(joint_action)) if not ok]
+            
+            for n in failed:
+                actions[n].insert(t, Action.NoOp)
+            for n in failed[1:]:
+                actions[n].insert(t + 1, Action.NoOp)
+            
+            waits += 2 * len(failed) - 1 if failed else 0
+            if waits > end:
+                log.debug("Agents would wait for each other, plan kept as it is.")
+                return False
+        
+        for agent, acts in zip(self.__agents, actions):
+            agent.clear_actions(keep_route=True)
+            agent.update_actions(acts)
+        
+        log.debug("%d waits added to the plan where actions would be rejected.", waits)
+        return True
+    
+    def __send(self, actions: [[Action, ...], ...]):
+        """Send the rest of the plan to the server, through the stream when streaming.
+        """
+        self.__streamed += len(actions)
+        
+        if self.__stream:
+            self.__stream_rest(actions)
+        else:
+            client.Client.send_to_server(actions, on_failure=self.__repair)
+    
+    def __repair(self, sent: [[Action, ...], ...], results: [[bool, ...], ...], remaining: [[Action, ...], ...],
+                 rejoin=None, max_expanded=20000):
+        """Localized replan after the server rejected actions (see Client.send_to_server).
+        
+        The world state is rebuilt from what the server actually executed, then a search
+        over the agents brings every agent and box where the plan expects them a few steps
+        ahead, and the plan goes on from there.
+
+        Returns:
+            [[Action, ...], ...]: joint actions to send instead of the remaining ones, or None
+        """
+        rejoin = min(rejoin or Controller.REJOIN_STEPS, len(remaining))
+        
+        # The world as the server left it: what it executed, replayed with its rules
+        world = Simulator.from_state(self.__initial, self.__goals)
+        executed = [
+            [act if ok else Action.NoOp for act, ok in zip(joint_action, succeeded)]
+            for joint_action, succeeded in zip(sent, results)
+        ]
+        
+        if not world.run(executed).all():
+            log.error("Could not follow the actions executed by the server.")
+            return None
+        
+        # Where the plan expects everything once the repair is over: as planned, the
+        # rejected actions included (replaying them with the server rules would fail again)
+        target = Simulator.from_state(self.__initial, self.__goals)
+        target.follow(list(sent) + remaining[:rejoin])
+
+        context = self.__initial.context
+        level = context.level
+        _context = StateContext(
+            level, context.agents, context.boxes, self.__goals,
+            agent_targets=[level.location_at(cell) for cell in target.agents],
+            box_targets=[level.location_at(cell) for cell in target.boxes]
+        )
+        
+        planner = GroupPlanner(State(_context, world.agents, world.boxes))
+        plan = planner.plan(tuple(range(len(world.agents))), agent_goals=True, max_expanded=max_expanded)
+        
+        __debug_msg = 'Repair after rejected actions: %s (%s).' % (
+            'found' if plan else 'not found', planner.nodes
+        )
+        print(__debug_msg, file=sys.stderr, flush=True)
+        log.debug(__debug_msg)
+        
+        if plan is None:
+            return None
+        
+        self.repairs += 1
+        steps, _ = plan
+        return [list(step) for step in steps] + remaining[rejoin:]
+    
+    def __send_committed(self):
+        """Stream the joint actions every agent has a plan for already, once agents
+        wait where the server would reject their action (see __sequence_actions).
+        """
+        if not self.__stream:
+            return
+        
+        committed = min(len(agent.actions) for agent in self.__agents)
+        
+        if committed <= self.__streamed:
+            return
+        
+        self.__sequence_actions(committed)
+        
+        actions = [
+            [agent.actions[t] for agent in self.__agents] for t in range(self.__streamed, committed)
+        ]
+        self.__streamed = committed
+        self.__sent.extend(actions)
+        self.__stream.send(actions)
+    
+    def __stream_rest(self, actions: [[Action, ...], ...]):
+        """Stream the last joint actions as Client.send_to_server does: a look-ahead at
+        a time, with a repair (see __repair) once the server rejected an action, be it
+        one of these or one streamed while planning.
+        """
+        stream = self.__stream
+        pending = list(actions)
+        checked = 0  # Responses looked at already
+        repairs = 0
+        
+        while True:
+            if not stream.wait():
+                log.error("Server closed the connection after %d joint actions.", len(stream.responses))
+                return
+            
+            results = [client.Client.parse_response(r, len(self.__agents)) for r in stream.responses]
+            
+            if not all(all(result) for result in results[checked:]) and repairs < client.Client.MAX_REPAIRS:
+                repairs += 1
+                repaired = self.__repair(self.__sent, results, pending)
+                
+                if repaired is not None:
+                    pending = repaired
+            checked = len(results)
+            
+            if not pending:
+                return
+            
+            actions, pending = pending[:client.Client.LOOKAHEAD], pending[client.Client.LOOKAHEAD:]
+            self.__sent.extend(actions)
+            stream.send(actions)
+        
+    def __cooperative_actions(self, agent: Agent, destination: Location, max_expanded=20000) -> [Action, ...]:
+        """Cooperative A*: space-time A* from the agent location to the destination,
+        waiting for or going around the cells reserved by the agents planned before.
+
+        Returns:
+            [Action, ...]: Move and NoOp actions, or None if no route was found
+        """
+        moves = self.__level.moves.moves
+        reservations = self.__reservations
+        start = self.__level.index_of(agent.location)
+        end = self.__level.index_of(destination)
+        t0 = len(agent.actions)
+        ignore = (id(agent), )
+        
+        # From the horizon on, reservations do not change with time anymore
+        horizon = reservations.horizon
+        distances = self.__level.distances.distances_to(end)
+        
+        frontier = Frontier()
+        frontier.put(distances[start], (start, t0, None, None), key=(start, min(t0, horizon)))
+        explored = set()
+        
+        while frontier and len(explored) < max_expanded:
+            _, node = frontier.get()
+            cell, t, _, _ = node
+            
+            if cell == end and reservations.is_free(end, t, ignore) and reservations.is_free(end, t + 1, ignore):
+                actions = []
+                while node[3] is not None:
+                    actions.append(node[2])
+                    node = node[3]
+                return actions[::-1]
+            
+            explored.add((cell, min(t, horizon)))
+            
+            for action, cell_to, box_from, _ in moves[cell]:
+                if box_from >= 0:
+                    continue
+                
+                key = (cell_to, min(t + 1, horizon))
+                if key in explored:
+                    continue
+                
+                # Cells can only be entered when nobody is there at the start of the step,
+                # and nobody may enter them at the next step
+                if not reservations.is_free(cell_to, t + 1, ignore) or \
+                        not reservations.is_free(cell_to, t + 2, ignore) or \
+                        (cell_to != cell and not reservations.is_free(cell_to, t, ignore)):
+                    continue
+                
+                frontier.put(t + 1 - t0 + distances[cell_to], (cell_to, t + 1, action, node), key=key)
+        
+        log.debug("No cooperative route from %s to %s.", agent.location, destination)
+        return None
+    
+    def __outcomes(self, cell: int, actions: [Action, ...], box_cells: dict):
+        """Cells of an agent and of the box it moves after each action.
+
+        Yields:
+            (int, Box, int, int): agent cell, moved box (or None), box cell before and after
+        """
+        moves = self.__level.moves
+        box_cells = dict(box_cells)
+        
+        for act in actions:
+            cell, box_from, box_to = moves.outcome(cell, act)
+            box = box_cells.pop(box_from, None) if box_from >= 0 else None
+            
+            if box is not None:
+                box_cells[box_to] = box
+            yield cell, box, box_from, box_to
+    
+    def __delay_actions(self, agent: Agent, actions: [Action, ...], box_cells: dict, max_delay=256):
+        """Make the agent wait before a fixed sequence of actions (e.g. from the state search)
+        until it does not meet any reservation.
+
+        Returns:
+            [Action, ...]: the actions, preceded by NoOps
+        """
+        reservations = self.__reservations
+        start = self.__level.index_of(agent.location)
+        t0 = len(agent.actions)
         
+        steps = list(self.__outcomes(start, actions, box_cells))
+        ignore = {id(agent)}.union(id(box) for _, box, _, _ in steps if box is not None)
+        
+        for delay in range(max_delay):
+            t = t0 + delay
+            
+            if not reservations.is_free(start, t, ignore) or not reservations.is_free(start, t + 1, ignore):
+                break
+            
+            cells = {start}
+            free = True
+            
+            for n, (cell, box, _, box_to) in enumerate(steps):
+                _cells = {cell, box_to} if box is not None else {cell}
+                
+                for _cell in _cells:
+                    if not reservations.is_free(_cell, t + n + 1, ignore) or \
+                            not reservations.is_free(_cell, t + n + 2, ignore) or \
+                            (_cell not in cells and not reservations.is_free(_cell, t + n, ignore)):
+                        free = False
+                        break
+                
+                if not free:
+                    break
+                cells = _cells
+            
+            if free:
+                return [Action.NoOp for _ in range(delay)] + actions
+        
+        log.debug("Could not find a conflict free start for %s.", agent)
+        return actions
+    
+    def __reserve_actions(self, agent: Agent, cell: int, t: int, actions: [Action, ...], box_cells: dict):
+        """Reserve the cells taken by the agent and the boxes it moves from time step t on.
+        """
+        reservations = self.__reservations
+        reservations.leave(cell, t, id(agent))
+        reservations.reserve(cell, t, id(agent))
+        
+        for cell, box, box_from, box_to in self.__outcomes(cell, actions, box_cells):
+            t += 1
+            reservations.reserve(cell, t, id(agent))
+            
+            if box is not None:
+                reservations.leave(box_from, t, id(box))
+                reservations.rest(box_to, t, id(box))
+        
+        reservations.rest(cell, t, id(agent))
+    
     def __check_route_conflicts(self):
         """Check route conflicts and make agents wait
         """
@@ -460,9 +1101,12 @@ class Controller(object):
     def __location_from_actions(self, initial_loc: 'Location', actions: '[Action, ...]', return_route=False):
         plan = []
         last_loc = initial_loc
+        cell = self.__level.index_of(initial_loc)
         
         for act in actions:
-            last_loc = self.__level.location_from_action(last_loc, act)
+            # Agent cell after the action (see MoveTable)
+            cell = self.__level.moves.agent_to(cell, act)
+            last_loc = self.__level.location_at(cell)
             plan.append(last_loc)
         
         if return_route: return last_loc, plan
@@ -543,8 +1187,22 @@ class Controller(object):
     def deploy(self) -> [Action, ...]:
         # Code goes here
         log.debug("Deploying...")
+        
+        # Snapshot of the initial world state, to follow what the server executes
+        self.__initial = State.from_actors(self.__level, self.__agents, self.__boxes, self.__goals)
         self.__define_initial_destinations()
-        self.__planner()
+        
+        try:
+            self.__planner()
+        finally:
+            self.metrics.close()
+        
+        if self.__stream and not self.__stream.close():
+            log.warning("The server did not answer every joint action.")
+        
+        __debug_msg = 'Route cache: %s.' % self.__route_cache.stats()
+        print(__debug_msg, file=sys.stderr, flush=True)
+        log.debug(__debug_msg)
         log.debug("Finished deploying.")
     
     def __goal_for_agent(self, agent: Agent) -> [Location, ...]:
@@ -569,23 +1227,28 @@ class Controller(object):
         return f_goal
 
     def __destination_for_box(self, box: Box) -> Location:
-        log.debug("Finding destination for boxes.")
+        """Assign the goals of the box letter again, from where the boxes are now
+        (see GoalAssignment.reassign), and return the new destination of the box.
+        Boxes being moved by an agent keep their destination.
+        """
+        moving = [
+            agent.desire.element for agent in self.__agents if agent.desire and agent.desire.is_box_desire()
+        ]
         
-        _dests = PriorityQueue()
-        other_destinations = set(box.destination for box in self.__boxes if box.destination)
-
-        for loc, goal in self.__goals.items():
-            if loc not in other_destinations and goal.identifier == box.identifier:
-                dist = box.location.distance(goal.location)
-                _dests.put((dist, loc))
+        for _box, _d in self.__assignment.reassign(box.identifier, self.__boxes, fixed=moving):
+            log.debug("%s destination changed from %s to %s.", _box, _box.destination, _d)
+            
+            # Boxes with a destination are the goals of their owner (see __goal_for_agent)
+            if _box is not box:
+                owner = self.get_box_owner(_box)
                 
-                log.debug("%s destination is %s, with distance %d." % (box, goal, dist))
+                if _d is None:
+                    owner.goals = [g for g in owner.goals if g is not _box]
+                elif _box.destination is None and not any(g is _box for g in owner.goals):
+                    owner.add_goal(_box)
+            _box.destination = _d
         
-        log.debug("Done finding destination for boxes.")
-        # If a box has more than one destination we only care about the closest
-        # @TODO: Can be improved
-        if not _dests.empty(): return _dests.get()[1]
-        return None
+        return box.destination
 
     def __find_route(self, start: Location, end: Location):
         """ Implementatoin of Greedy BFS
@@ -607,6 +1270,11 @@ class Controller(object):
         # start = self.__level.get_location((start.row, start.col), translate=True)
         # end = self.__level.get_location((end.row, end.col), translate=True)
         
+        # Checking cache (routes only go around walls, see RouteCache)
+        _r = self.__route_cache.get(start, end)
+        if _r is not None:
+            return _r
+        
         class Node(object):
             location = None
             parent = None
@@ -621,16 +1289,9 @@ class Controller(object):
             def __lt__(self, other):
                 return self.location < other.location
         
-        frontier = PriorityQueue()
-        frontier.put((start.distance(end), Node(start, None)))
+        frontier = Frontier()
+        frontier.put(end.distance(start), Node(start, None), key=start)
         explored = set()
-        _rhash = hash((start, end))
-        
-        # Checking cache
-        try:
-            return self.__cached_routes[_rhash]
-        except KeyError:
-            pass
         
         # Is end nearby?
         if end in start.neighbors: return [end, ]
@@ -658,16 +1319,15 @@ class Controller(object):
                 _r = path[::-1]
                 # Ignore the first position (start)
                 #_r = _r[1:]
-                self.__cached_routes.update({_rhash: _r})
+                self.__route_cache.put(start, end, _r)
                 return _r
 
             explored.add(visited)
             expanded = visited.neighbors
             
             for loc in expanded:
-                nnode = loc.distance(end), Node(loc, node)
-                if not (nnode in frontier.queue or loc in explored) and not loc.is_wall:
-                    frontier.put(nnode)
+                if not (loc in frontier or loc in explored) and not loc.is_wall:
+                    frontier.put(end.distance(loc), Node(loc, node), key=loc)
 
     @staticmethod
     def generate_move_actions(path: '[Location, ...]') -> '[Actions, ...]':
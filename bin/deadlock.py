@@ -0,0 +1,83 @@
+import logging
+
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+
+
+class DeadlockTable(object):
+    """Dead squares of a level: cells from which a box can never reach its target.
+
+    A box moves into a free neighbor cell when pushed (the agent steps into the box
+    cell from any other free neighbor of it: pushes may turn) or pulled (the agent
+    steps away from the box, to another free neighbor of the cell it leaves). Cells
+    a box can reach the target from are found going backwards from the target, with
+    these two rules reversed.
+    Other agents and boxes are ignored, except static ones (e.g. boxes nobody can
+    move), which are walls here: a dead square is dead whatever the state.
+
+    Maps are computed on first use for every (target, static cells) pair and kept
+    for the whole level, so every search sharing the level shares them.
+    """
+
+    def __init__(self, level: 'Level'):
+        self.__level = level
+        self.__maps = {}  # (target, static cells): bytearray, 1 for dead squares
+
+    def __len__(self):
+        return len(self.__maps)
+
+    def dead_squares(self, target: int, static: frozenset = frozenset()) -> bytearray:
+        """Dead squares for a box with the given target cell.
+
+        Args:
+            target (int): cell index the box must reach
+            static (frozenset, optional): cells taken for good by something else than walls
+
+        Returns:
+            bytearray: 1 for the cells the box cannot reach the target from, 0 elsewhere
+        """
+        key = (target, static)
+        dead = self.__maps.get(key)
+
+        if dead is None:
+            dead = self.__maps[key] = self.__reverse_reach(target, static)
+            log.debug("Dead squares for target %d: %d.", target, dead.count(1))
+        return dead
+
+    def __reverse_reach(self, target: int, static: frozenset) -> bytearray:
+        level = self.__level
+        walls = level.walls
+
+        def is_free(cell):
+            return not walls[cell] and cell not in static
+
+        # Walls count as dead, so a single lookup tells whether a box may go to a cell
+        dead = bytearray(1 for _ in range(len(walls)))
+
+        if not is_free(target):
+            return dead
+
+        dead[target] = 0
+        queue = deque((target, ))
+
+        while queue:
+            cell = queue.popleft()
+            neighbors = [n for n in level.neighbors(cell) if is_free(n)]
+
+            for previous in neighbors:
+                if not dead[previous]:
+                    continue
+
+                # Pushed from previous to cell: the agent came from another free neighbor of previous
+                pushed = any(n != cell and is_free(n) for n in level.neighbors(previous))
+
+                # Pulled from previous to cell: the agent went on from cell to another free cell
+                pulled = any(n != previous for n in neighbors)
+
+                if pushed or pulled:
+                    dead[previous] = 0
+                    queue.append(previous)
+
+        return dead
@@ -0,0 +1,353 @@
+import time
+import logging
+
+from frontier import Frontier
+from state import State, StateContext
+from action import Action, ActionType
+
+
+log = logging.getLogger(__name__)
+
+
+class _Node(object):
+    """Node of the operator decomposition search.
+    Full nodes (k == 0) are regular states. Intermediate nodes have an action
+    assigned to the first k agents of the current step: agents/boxes hold the
+    positions after those actions, base_agents/base_boxes the positions at the
+    start of the step.
+    """
+    __slots__ = ('base_agents', 'base_boxes', 'agents', 'boxes', 'k', 'g', 'parent', 'action', 'claimed', 'moved')
+
+    def __init__(self, base_agents, base_boxes, agents, boxes, k, g, parent, action, claimed, moved):
+        self.base_agents = base_agents
+        self.base_boxes = base_boxes
+        self.agents = agents
+        self.boxes = boxes
+        self.k = k
+        self.g = g
+        self.parent = parent
+        self.action = action  # Action of agent k - 1
+        self.claimed = claimed  # Cells entered during the current step
+        self.moved = moved  # Boxes moved during the current step
+
+
+def initial_groups(context: StateContext) -> [(int, ...), ...]:
+    """One group per agent, except agents of a color with boxes, which share them
+    and are planned together.
+    """
+    groups = []
+
+    for color in dict.fromkeys(context.agent_colors):
+        same_color = tuple(na for na, c in enumerate(context.agent_colors) if c == color)
+
+        if color in context.box_colors:
+            groups.append(same_color)
+        else:
+            groups.extend((na, ) for na in same_color)
+
+    return groups
+
+
+def find_conflict(groups: [(int, ...), ...], plans: dict) -> tuple:
+    """First conflict in between the plans of two groups: both take the same cell at
+    the same time, or one enters a cell the other is in at the start of the step
+    (swaps, following). Groups stay where their plan ends.
+
+    Args:
+        plans (dict): group: (steps, timeline) as returned by GroupPlanner.plan
+
+    Returns:
+        tuple: (first group, second group, (cell, time) to forbid to the first,
+        (cell, time) to forbid to the second), or None
+    """
+    horizon = max(len(plans[group][1]) for group in groups)
+
+    def cells(group, t):
+        timeline = plans[group][1]
+        return timeline[min(t, len(timeline) - 1)]
+
+    for t in range(horizon):
+        for n, first in enumerate(groups):
+            for second in groups[n + 1:]:
+                common = cells(first, t) & cells(second, t)
+                if common:
+                    cell = min(common)
+                    return first, second, (cell, t), (cell, t)
+
+                if not t:
+                    continue
+
+                common = cells(first, t) & cells(second, t - 1)
+                if common:
+                    cell = min(common)
+                    return first, second, (cell, t), (cell, t - 1)
+
+                common = cells(first, t - 1) & cells(second, t)
+                if common:
+                    cell = min(common)
+                    return first, second, (cell, t - 1), (cell, t)
+    return None
+
+
+def replay(initial: State, groups: [(int, ...), ...], plans: dict) -> State:
+    """Apply the plans of all groups together from the initial state.
+
+    Returns:
+        State: the last state, with parents leading to the initial state
+    """
+    horizon = max(len(plans[group][0]) for group in groups)
+    state = initial
+
+    for t in range(horizon):
+        joint_actions = [Action.NoOp for _ in initial.agents]
+
+        for group in groups:
+            steps = plans[group][0]
+
+            if t < len(steps):
+                for na, action in zip(group, steps[t]):
+                    joint_actions[na] = action
+
+        _state = state.successor(tuple(joint_actions))
+
+        if _state is None:
+            __err = "Could not merge the plans of agents %s at step %d." % (groups, t)
+            log.error(__err)
+            raise Exception(__err)
+        state = _state
+
+    return state
+
+
+class GroupPlanner(object):
+    """A* with operator decomposition for a group of agents, ignoring the other agents.
+
+    A step assigns an action to one agent of the group at a time, so the branching
+    factor is the number of moves of one agent instead of the product over all
+    agents of the group. Boxes of the group colors are moved by the group, boxes
+    nobody in the search can move and blocked cells (see LevelOverlay) are obstacles
+    and the rest is ignored.
+
+    Plans can be constrained by (cell, time) pairs the group must not take,
+    which turns the search into a space-time search up to the last constrained time.
+    """
+
+    def __init__(self, initial: State, nodes: dict = None):
+        self.__initial = initial
+        self.__context = initial.context
+
+        # Node counts
+        self.nodes = nodes if nodes is not None else {}
+        for count in ('expanded', 'intermediate', 'generated', 'groups'):
+            self.nodes.setdefault(count, 0)
+
+    def plan(self, group: (int, ...), constraints=(), agent_goals=False, max_expanded=None, deadline=None):
+        """Plan a group of agents (indexes in the StateContext).
+
+        Args:
+            group ((int, ...)): agents of the group
+            constraints (optional): (cell, time) pairs the group agents and boxes must not take
+            agent_goals (bool, optional): whether agents must reach their targets as well.
+            By default the goal is the same as State.is_goal_state.
+            max_expanded (int, optional): give up after expanding this many states
+            deadline (float, optional): give up once time.perf_counter() is past it
+
+        Returns:
+            tuple: actions of the group agents per step, and the cells taken by the
+            group agents and boxes at each time step (starting at 0). None if there is no plan.
+        """
+        self.nodes['groups'] += 1
+        context = self.__context
+        initial = self.__initial
+
+        colors = tuple(context.agent_colors[na] for na in group)
+        all_colors = set(context.agent_colors)
+        box_ids = tuple(nb for nb, color in enumerate(context.box_colors) if color in colors)
+
+        # Boxes nobody in this search can move and cells blocked by a level overlay
+        # (see LevelOverlay) are obstacles for everyone
+        static = frozenset(getattr(context.level, 'blocked', ())).union(
+            cell for nb, cell in enumerate(initial.boxes) if context.box_colors[nb] not in all_colors
+        )
+        box_colors = tuple(context.box_colors[nb] for nb in box_ids)
+        agent_distances = tuple(context.agent_distances[na] for na in group)
+        box_distances = tuple(context.box_distances[nb] for nb in box_ids)
+        box_dead = tuple(context.box_dead[nb] for nb in box_ids)
+        agent_targets = tuple(context.agent_targets[na] for na in group)
+        box_targets = tuple(context.box_targets[nb] for nb in box_ids)
+
+        # Constraints: cells per time, and last time each cell is constrained
+        forbidden = {}
+        latest = {}
+        for cell, t in constraints:
+            forbidden.setdefault(t, set()).add(cell)
+            latest[cell] = max(t, latest.get(cell, -1))
+        horizon = max(forbidden, default=-1) + 1  # Time does not matter from here on
+
+        def h(agents, boxes):
+            return sum(d[c] for c, d in zip(agents, agent_distances) if d) + \
+                sum(d[c] for c, d in zip(boxes, box_distances) if d)
+
+        def is_goal(agents, boxes, t):
+            if (initial.boxes and not agent_goals) or agent_goals:
+                if not all(target < 0 or c == target for c, target in zip(boxes, box_targets)):
+                    return False
+            if not initial.boxes or agent_goals:
+                if not all(target < 0 or c == target for c, target in zip(agents, agent_targets)):
+                    return False
+            # The group stays there: no constraint may come later
+            return all(latest.get(c, -1) < t for c in agents + boxes)
+
+        num_agents = len(group)
+        agents = tuple(initial.agents[na] for na in group)
+        boxes = tuple(initial.boxes[nb] for nb in box_ids)
+
+        if forbidden.get(0, set()).intersection(agents + boxes):
+            return None
+
+        frontier = Frontier()
+        frontier.put(h(agents, boxes), _Node(agents, boxes, agents, boxes, 0, 0, None, None, frozenset(), frozenset()))
+        explored = set()
+        expanded = 0
+
+        while frontier:
+            _, node = frontier.get()
+
+            if node.k == 0:
+                if is_goal(node.agents, node.boxes, node.g):
+                    return self.__extract(node, num_agents)
+
+                explored.add((node.agents, node.boxes, min(node.g, horizon)))
+                self.nodes['expanded'] += 1
+                expanded += 1
+
+                if max_expanded and expanded > max_expanded:
+                    return None
+
+                if deadline and time.perf_counter() > deadline:
+                    return None
+            else:
+                self.nodes['intermediate'] += 1
+
+            na = node.k
+            occupied = static.union(node.base_agents, node.base_boxes)
+            box_at = {cell: nb for nb, cell in enumerate(node.base_boxes)}
+
+            for action, agent_to, box_from, box_to in context.moves[node.base_agents[na]]:
+                claimed = node.claimed
+                moved = node.moved
+                _boxes = node.boxes
+
+                if action.type is not ActionType.NoOp:
+                    if action.type is not ActionType.Push and (agent_to in occupied or agent_to in claimed):
+                        continue
+
+                    claimed = claimed.union((agent_to, ))
+
+                    if box_from >= 0:
+                        nb = box_at.get(box_from)
+
+                        if nb is None or nb in moved or box_colors[nb] != colors[na]:
+                            continue
+
+                        # The box could not reach its target anymore (see StateContext)
+                        if box_dead[nb] is not None and box_dead[nb][box_to]:
+                            continue
+
+                        if action.type is ActionType.Push and (box_to in occupied or box_to in claimed):
+                            continue
+
+                        claimed = claimed.union((box_to, ))
+                        moved = moved.union((nb, ))
+                        _boxes = _boxes[:nb] + (box_to, ) + _boxes[nb + 1:]
+
+                _agents = node.agents[:na] + (agent_to, ) + node.agents[na + 1:]
+                self.nodes['generated'] += 1
+
+                if na + 1 == num_agents:
+                    # Step complete
+                    g = node.g + 1
+                    key = (_agents, _boxes, min(g, horizon))
+
+                    if key in explored:
+                        continue
+
+                    if g in forbidden and forbidden[g].intersection(_agents + _boxes):
+                        continue
+
+                    child = _Node(_agents, _boxes, _agents, _boxes, 0, g, node, action, frozenset(), frozenset())
+                    frontier.put(g + h(_agents, _boxes), child, key=key)
+                else:
+                    child = _Node(
+                        node.base_agents, node.base_boxes, _agents, _boxes, na + 1, node.g, node, action, claimed, moved
+                    )
+                    frontier.put(
+                        node.g + 1 + h(_agents, _boxes), child,
+                        key=(node.base_agents, node.base_boxes, na + 1, _agents, _boxes, min(node.g, horizon))
+                    )
+
+        return None
+
+    @staticmethod
+    def __extract(node: _Node, num_agents: int) -> ([(Action, ...), ...], [frozenset, ...]):
+        actions = []
+        timeline = [frozenset(node.agents + node.boxes)]
+
+        while node.parent is not None:
+            actions.append(node.action)
+            node = node.parent
+
+            if node.k == 0:
+                timeline.append(frozenset(node.agents + node.boxes))
+
+        actions.reverse()
+        timeline.reverse()
+        steps = [tuple(actions[n:n + num_agents]) for n in range(0, len(actions), num_agents)]
+        return steps, timeline
+
+
+class DecompositionSearch(object):
+    """Multi-agent state search by operator decomposition and independence detection.
+
+    Agents are split in groups (see initial_groups) and every group is planned on
+    its own with GroupPlanner, ignoring the others. When the plans of two groups
+    conflict, the groups are merged and planned together.
+    """
+
+    def __init__(self, initial: State):
+        self.__initial = initial
+
+        # Node counts, comparable with the joint search
+        self.nodes = {'expanded': 0, 'intermediate': 0, 'generated': 0, 'groups': 0, 'merges': 0}
+        self.__planner = GroupPlanner(initial, self.nodes)
+
+    def __plan(self, group: (int, ...)):
+        plan = self.__planner.plan(group)
+
+        if plan is None:
+            __err = "Could not find a plan for agents %s. Problem infeasible?" % (group, )
+            log.error(__err)
+            raise Exception(__err)
+        return plan
+
+    def solve(self) -> State:
+        """Goal state, with the parents leading to it from the initial state.
+        """
+        groups = initial_groups(self.__initial.context)
+        plans = {group: self.__plan(group) for group in groups}
+
+        while True:
+            conflict = find_conflict(groups, plans)
+
+            if conflict is None:
+                break
+
+            first, second = conflict[:2]
+            merged = tuple(sorted(first + second))
+            log.debug("Merging agent groups %s and %s.", first, second)
+
+            groups = [group for group in groups if group not in (first, second)] + [merged]
+            plans[merged] = self.__plan(merged)
+            self.nodes['merges'] += 1
+
+        return replay(self.__initial, groups, plans)
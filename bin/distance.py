@@ -0,0 +1,169 @@
+import logging
+import numpy as np
+
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+
+
+class DistanceTable(object):
+    """True shortest path distances (BFS over walls) between all free cells.
+
+    Distances are kept in one contiguous (free cells x free cells) uint16 array,
+    shared by the Level and all its Locations. Cells are the flat cell indexes
+    used by Level (row * num_cols + col, counting outside walls).
+
+    When lazy, a row is only computed the first time a distance from (or to)
+    its cell is asked for. Untouched rows of the array are never written, so
+    they do not take physical memory.
+    """
+    UNREACHABLE = np.iinfo(np.uint16).max
+    LAZY_THRESHOLD = 3000  # Free cells above which rows are computed on demand by default
+
+    def __init__(self, walls: np.ndarray, lazy=None):
+        """
+        Args:
+            walls (np.ndarray): (rows, cols) boolean wall mask, outside walls included
+            lazy (bool, optional): compute rows on first use. Defaults to automatic
+            (lazy for levels with more than LAZY_THRESHOLD free cells).
+        """
+        num_rows, num_cols = walls.shape
+        self.__num_cols = num_cols
+
+        free = np.flatnonzero(~walls.ravel())
+        num_free = free.size
+
+        # Cell index -> row in the table (-1 for walls)
+        self.__slot = np.full(num_rows * num_cols, -1, dtype=np.int64)
+        self.__slot[free] = np.arange(num_free)
+        self.__slots = self.__slot.tolist()
+        self.__free = free
+
+        # Neighbors (north, south, east, west) of every free cell in table rows, -1 if wall
+        neighbors = free[:, None] + np.array([-num_cols, num_cols, 1, -1])
+        np.clip(neighbors, 0, num_rows * num_cols - 1, out=neighbors)
+        self.__adjacency = self.__slot[neighbors]
+
+        if lazy is None:
+            lazy = num_free > DistanceTable.LAZY_THRESHOLD
+        self.__lazy = lazy
+
+        if lazy:
+            self.__table = np.empty((num_free, num_free), dtype=np.uint16)
+            self.__computed = np.zeros(num_free, dtype=bool)
+            self.__neighbor_lists = [[n for n in row if n >= 0] for row in self.__adjacency.tolist()]
+        else:
+            self.__table = np.full((num_free, num_free), DistanceTable.UNREACHABLE, dtype=np.uint16)
+            self.__computed = np.ones(num_free, dtype=bool)
+            self.__batched_bfs()
+
+        log.debug("Distance table for %d free cells (lazy: %s).", num_free, lazy)
+
+    def __deepcopy__(self, memo):
+        # Static data, shared by every copy of the level
+        return self
+
+    @property
+    def lazy(self):
+        return self.__lazy
+
+    def __batched_bfs(self, batch_size=1024):
+        """BFS from every free cell, a batch of sources at a time.
+        The frontier is a list of (source, cell) pairs expanded one level per step.
+        """
+        table = self.__table
+        adjacency = self.__adjacency
+        num_free = table.shape[0]
+
+        # Scratch space to drop pairs reached more than once in the same step
+        owner = np.empty(min(batch_size, num_free) * num_free, dtype=np.int32)
+
+        for first in range(0, num_free, batch_size):
+            sources = np.arange(first, min(first + batch_size, num_free))
+            cells = sources.copy()
+            table[sources, cells] = 0
+            dist = 0
+
+            while sources.size:
+                dist += 1
+                _sources = np.repeat(sources, 4)
+                _cells = adjacency[cells].ravel()
+
+                keep = _cells >= 0
+                _sources, _cells = _sources[keep], _cells[keep]
+
+                keep = table[_sources, _cells] == DistanceTable.UNREACHABLE
+                _sources, _cells = _sources[keep], _cells[keep]
+
+                # Several cells of the frontier may reach the same cell: keep one of them
+                pairs = (_sources - first) * num_free + _cells
+                order = np.arange(pairs.size, dtype=np.int32)
+                owner[pairs] = order
+                keep = owner[pairs] == order
+
+                sources, cells = _sources[keep], _cells[keep]
+                table[sources, cells] = dist
+
+    def __bfs(self, slot: int):
+        """Compute a single row of the table.
+        """
+        row = [DistanceTable.UNREACHABLE] * self.__table.shape[0]
+        row[slot] = 0
+        neighbors = self.__neighbor_lists
+        queue = deque((slot, ))
+
+        while queue:
+            current = queue.popleft()
+            dist = row[current] + 1
+
+            for n in neighbors[current]:
+                if row[n] == DistanceTable.UNREACHABLE:
+                    row[n] = dist
+                    queue.append(n)
+
+        self.__table[slot] = row
+        self.__computed[slot] = True
+
+    def __row(self, slot: int) -> np.ndarray:
+        if not self.__computed[slot]:
+            self.__bfs(slot)
+        return self.__table[slot]
+
+    def distance(self, cell: int, other: int) -> int:
+        """Shortest path distance between two cell indexes.
+        Cells that are not free fall back to Manhattan distance.
+        """
+        slot = self.__slots[cell]
+        oslot = self.__slots[other]
+
+        if slot < 0 or oslot < 0:
+            row, col = divmod(cell, self.__num_cols)
+            orow, ocol = divmod(other, self.__num_cols)
+            return abs(row - orow) + abs(col - ocol)
+
+        # The graph is undirected, use whichever row is already there
+        # (or compute the row of the first cell)
+        if self.__computed[oslot]:
+            return int(self.__table[oslot, slot])
+        return int(self.__row(slot)[oslot])
+
+    def between(self, location: 'Location', other: 'Location') -> int:
+        """Shortest path distance between two locations.
+        """
+        return self.distance(
+            location.row * self.__num_cols + location.col,
+            other.row * self.__num_cols + other.col
+        )
+
+    def distances_to(self, cell: int) -> [int, ...]:
+        """Distances from every cell index to the given cell, as a list indexed by cell index.
+        Handy in hot loops, where indexing a list is much cheaper than a table lookup.
+        """
+        slot = self.__slots[cell]
+        _distances = np.full(self.__slot.size, DistanceTable.UNREACHABLE, dtype=np.int64)
+
+        if slot >= 0:
+            _distances[self.__free] = self.__row(slot)
+
+        return _distances.tolist()
@@ -0,0 +1,107 @@
+import heapq
+
+from itertools import count
+
+
+class Frontier(object):
+    """Open list for the searches.
+    A binary heap ordered by priority together with a hash index of the items
+    in it, so membership checks are O(1). Updating the priority of an item
+    (decrease-key) is done by lazy deletion: the old heap entry is flagged as
+    removed and skipped when it reaches the top.
+
+    Items are indexed by themselves unless a key is given, e.g. a Location for
+    the nodes of a route search. Not thread-safe (searches are single threaded).
+    """
+    __REMOVED = object()
+
+    def __init__(self):
+        self.__heap = []
+        self.__index = {}  # key: heap entry
+        self.__counter = count()  # Tie breaker, keeps insertion order for equal priorities
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, key):
+        return key in self.__index
+
+    def __bool__(self):
+        return bool(self.__index)
+
+    def empty(self) -> bool:
+        return not self.__index
+
+    def put(self, priority, item, key=None) -> bool:
+        """Add an item to the frontier, or lower its priority if it is already there.
+
+        Args:
+            priority: heap priority (lowest first)
+            item: the element to be returned by get
+            key (optional): key used for membership. Defaults to the item itself.
+
+        Returns:
+            bool: whether the item was added or updated
+        """
+        if key is None:
+            key = item
+
+        entry = self.__index.get(key)
+
+        if entry is not None:
+            if entry[0] <= priority:
+                return False
+            # Decrease-key: forget the old entry
+            entry[2] = Frontier.__REMOVED
+
+        entry = [priority, next(self.__counter), item, key]
+        self.__index[key] = entry
+        heapq.heappush(self.__heap, entry)
+        return True
+
+    def prune(self, size: int) -> int:
+        """Keep the size items with the lowest priority and drop the others.
+
+        Returns:
+            int: number of items dropped
+        """
+        entries = sorted(entry for entry in self.__heap if entry[2] is not Frontier.__REMOVED)
+        dropped = entries[size:]
+
+        for entry in dropped:
+            del self.__index[entry[3]]
+
+        # A sorted list is a heap already
+        self.__heap = entries[:size]
+        return len(dropped)
+
+    def peek(self):
+        """The (priority, item) with the lowest priority, left in the frontier.
+        """
+        heap = self.__heap
+
+        while heap and heap[0][2] is Frontier.__REMOVED:
+            heapq.heappop(heap)
+
+        if not heap:
+            raise IndexError('peek at an empty frontier')
+        return heap[0][0], heap[0][2]
+
+    def items(self):
+        """Items in the frontier, in no particular order.
+        """
+        return (entry[2] for entry in self.__index.values())
+
+    def get(self):
+        """Remove and return the (priority, item) with the lowest priority.
+        """
+        heap = self.__heap
+
+        while heap:
+            priority, _, item, key = heapq.heappop(heap)
+
+            if item is not Frontier.__REMOVED:
+                del self.__index[key]
+                return priority, item
+
+        raise IndexError('get from an empty frontier')
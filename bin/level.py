@@ -2,9 +2,8 @@ import logging
 import sys
 import numpy as np
 
-from copy import deepcopy
-
 from location import Location
+from deadlock import DeadlockTable
 from action import Action, ActionType
 
 
@@ -13,50 +12,112 @@ log = logging.getLogger(__name__)
 
 class Level(object):
     """A redifined definition of a level
-    Defines locations as a a set of locations, together with its neighbors.
-    """
+    Cells are identified by their index (row * num_cols + col, counting outside walls).
+    The level keeps a wall mask and the neighbors of every free cell in compressed
+    (CSR) form, so it takes memory in proportion to the number of cells. Location
+    objects are views on a cell, created on demand.
 
-    def __init__(self, layout: '[[Location, ...], ...]', num_rows: int, num_cols: int, corners: [Location, ...]):
-        # Representation of the level in Location objects, ignoring outside walls.
-        # This means row 1 in the level is actually located in row 0 in this array.
-        # [
-        #   [L1,1, L1,2, L1,3],
-        #   [L2,1, L2,2, ... ]
-        # ]
+    A level never changes once built: copies share it, and searches that need
+    cells of their own blocked work on an overlay (see overlay).
+    """
 
-        self.__layout = layout
+    def __init__(self, walls: np.ndarray, distances: 'DistanceTable'):
+        """
+        Args:
+            walls (np.ndarray): (rows, cols) boolean wall mask, outside walls included
+            distances (DistanceTable): shortest path distances in between free cells
+        """
+        num_rows, num_cols = walls.shape
         self.__num_rows = num_rows  # Total number of rows (counting outside walls)
-        self.__num_cols = num_cols  # Total number of cols (counting outside walls)        
+        self.__num_cols = num_cols  # Total number of cols (counting outside walls)
         self._hash = None
-        self.__corners = corners
-        
+        self.__distances = distances  # Shortest path distances in between free cells
+        self.__moves = None  # MoveTable, see Configuration.build_structure
+        self.__deadlocks = None  # DeadlockTable, built on first use
+
+        # Flat cell representation used by the search. Outside walls are always walls.
+        walls = walls.copy()
+        walls[[0, -1], :] = True
+        walls[:, [0, -1]] = True
+        self.__walls = bytearray(walls.astype(np.uint8).tobytes())
+
+        # Neighbors of every free cell (south, north, east, west), in CSR form:
+        # the neighbors of cell c are adjacent[offsets[c]:offsets[c + 1]]
+        cells = np.arange(num_rows * num_cols)
+        free = ~walls.ravel()
+        candidates = cells[:, None] + np.array([num_cols, -num_cols, 1, -1])
+        np.clip(candidates, 0, cells.size - 1, out=candidates)
+        is_adjacent = free[:, None] & free[candidates]
+
+        self.__offsets = np.concatenate(([0], np.cumsum(is_adjacent.sum(axis=1)))).astype(np.int32)
+        self.__adjacent = candidates[is_adjacent].astype(np.int32)
+        self.__neighbor_lists = None  # Python lists of the above, built on first use
+
+        # Corners: free cells with exactly one free neighbor vertically and one horizontally
+        vertical = is_adjacent[:, 0].astype(int) + is_adjacent[:, 1]
+        horizontal = is_adjacent[:, 2].astype(int) + is_adjacent[:, 3]
+        self.__corner_mask = free & (vertical == 1) & (horizontal == 1)
+        self.__corners = [self.location_at(cell) for cell in np.flatnonzero(self.__corner_mask).tolist()]
+
     def __hash__(self):
         if self._hash is None:
             prime = 37
             _hash = 1
-            _hash = _hash * prime + hash(tuple(tuple(row) for row in self.__layout))
+            _hash = _hash * prime + hash(bytes(self.__walls))
             _hash = _hash * prime + hash((self.__num_rows, self.__num_cols))
             self._hash = _hash
         return self._hash
     
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # Static data, shared by every copy
+        return self
+
     def clone(self):
-        """Return a deep copy of the object
+        """The level itself: it never changes, so there is nothing to copy.
+        Use overlay for a level with cells of its own.
+        """
+        return self
+
+    def overlay(self) -> 'LevelOverlay':
+        """Cheap view of this level for a sub-search, see LevelOverlay.
         """
-        return deepcopy(self)
+        return LevelOverlay(self)
     
     def __repr__(self):
-        return str(self.__layout)
+        return 'Level(%d x %d)' % (self.__num_rows, self.__num_cols)
 
     @property
     def corners(self):
         return self.__corners
-        
+
+    @property
+    def distances(self) -> 'DistanceTable':
+        return self.__distances
+
     @property
-    def layout(self):
-        return self.__layout
+    def deadlocks(self) -> 'DeadlockTable':
+        """Dead squares of boxes per target, shared by every search on this level.
+        """
+        if self.__deadlocks is None:
+            self.__deadlocks = DeadlockTable(self)
+        return self.__deadlocks
+
+    @property
+    def moves(self) -> 'MoveTable':
+        return self.__moves
     
-    def update_layout(self, layout):
-        self.__layout = layout
+    @moves.setter
+    def moves(self, table: 'MoveTable'):
+        self.__moves = table
+
+    @property
+    def walls(self):
+        """Wall mask indexed by cell index (1 is wall, 0 is free).
+        """
+        return self.__walls
 
     @property
     def num_rows(self):
@@ -86,10 +147,10 @@ class Level(object):
     
     def get_location(self, indexes: tuple, translate=False) -> Location:
         """Given the coordinates (row, col), which object location is at this position?
-        Important: the layout vector is 0-indexed, this means L1,1 is located in [0][0]
-        and L2,3 is located in [1][2]
+        Important: without translate, coordinates ignore outside walls (0-indexed),
+        this means L1,1 is at [0][0] and L2,3 at [1][2].
         
-        If translate is True, then the indexes are converted to 0-based indexes.
+        If translate is True, then the indexes are the real coordinates of the level.
 
         Args:
             coordinates (tuple): (row, col)
@@ -99,26 +160,58 @@ class Level(object):
             Location: object at this index
         """
         row, col = indexes
-        try:
-            if translate:
-                row = row - 1
-                col = col - 1
-            
-            if 0 > row or row > self.real_num_rows:
-                raise Exception(
-                    "Invalid row index row %d. Maybe use parameter translate?" % row
-                )
-                
-            if 0 > col or col > self.real_num_cols:
-                raise Exception(
-                    "Invalid row index col %d. Maybe use parameter translate?" % col
-                )
-            
-            return self.__layout[row][col]
-        except IndexError:
+
+        if not translate:
+            row = row + 1
+            col = col + 1
+
+        if not 0 < row < self.__num_rows - 1:
             raise Exception(
-                "Location in row %d col %d do not exist. Maybe use parameter translate?" % (row, col)
+                "Invalid row index row %d. Maybe use parameter translate?" % (row - 1)
             )
+
+        if not 0 < col < self.__num_cols - 1:
+            raise Exception(
+                "Invalid row index col %d. Maybe use parameter translate?" % (col - 1)
+            )
+
+        return Location(row, col, self)
+
+    def index_of(self, location: Location) -> int:
+        """Cell index of a location (row * num_cols + col, counting outside walls).
+        """
+        return location.row * self.__num_cols + location.col
+    
+    def location_at(self, index: int) -> Location:
+        """Location object of the given cell index.
+        """
+        return Location(index // self.__num_cols, index % self.__num_cols, self)
+
+    def is_wall(self, index: int) -> bool:
+        return self.__walls[index] == 1
+
+    def is_corner(self, index: int) -> bool:
+        return bool(self.__corner_mask[index])
+
+    def neighbors(self, index: int) -> [int, ...]:
+        """Cell indexes of the free neighbors of a cell.
+        """
+        if self.__neighbor_lists is None:
+            adjacent = self.__adjacent.tolist()
+            offsets = self.__offsets.tolist()
+            self.__neighbor_lists = [adjacent[offsets[n]:offsets[n + 1]] for n in range(len(offsets) - 1)]
+        return self.__neighbor_lists[index]
+
+    @property
+    def adjacency(self) -> (np.ndarray, np.ndarray):
+        """Neighbors of every cell in CSR form: (offsets, adjacent cells).
+        """
+        return self.__offsets, self.__adjacent
+    
+    def distance(self, index: int, other: int) -> int:
+        """Shortest path distance between two cell indexes.
+        """
+        return self.__distances.distance(index, other)
         
     def location_from_action(self, location: Location, action: Action, execute=False):
         """If we apply an action in a specific location, which locations do we get in return?
@@ -132,43 +225,85 @@ class Level(object):
             Location(s): if action is either Push or Pull, 
             we return Tuple(Agent Location, Box Location), otherwise Agent Location
         """
-        
-        _arow = location.row + action.agent_row_delta # Y
-        _acol = location.col + action.agent_col_delta # x
-        _apos = None
-        _bpos = None
-        
         if action.type is ActionType.NoOp:
             return location
-        
+
+        num_cols = self.__num_cols
+        cell = location.row * num_cols + location.col
+        agent_cell = cell + action.agent_row_delta * num_cols + action.agent_col_delta
+
         # Where agent will be
         if action.type is ActionType.Move:
-            return self.get_location((_arow, _acol), translate=True)
+            return self.__inner_location(agent_cell, strict=True)
 
         # Box position
+        box_delta = action.box_row_delta * num_cols + action.box_col_delta
+
+        if action.type is ActionType.Pull:
+            # Without execute: the inverse of where the box is supposed to be === where the box is
+            # We want this location to know if there is a box there
+            box_cell = cell if execute else cell - box_delta
         else:
-            if action.type is ActionType.Pull:
-                if not execute:
-                    # The inverse of where the box is supposed to be === where the box is
-                    # We want this location to know if there is a box there
-                    _brow = location.row + action.box_row_delta * -1
-                    _bcol = location.col + action.box_col_delta * -1
-                else:
-                    _brow = location.row
-                    _bcol = location.col
-            else:
-                _brow = _arow + action.box_row_delta
-                _bcol = _acol + action.box_col_delta
-            
-            try:
-                _apos = self.get_location((_arow, _acol), translate=True)  # Agent position
-            except Exception:
-                pass
-
-            try:
-                _bpos = self.get_location((_brow, _bcol), translate=True)   # Box position
-            except Exception:
-                pass
-            
-            return _apos, _bpos
-        raise Exception('Could not define location.')
+            box_cell = agent_cell + box_delta
+
+        return self.__inner_location(agent_cell), self.__inner_location(box_cell)
+
+    def __inner_location(self, cell: int, strict=False) -> Location:
+        """Location of a cell inside the outside walls (None, or an exception if strict, otherwise).
+        """
+        row, col = divmod(cell, self.__num_cols)
+
+        if 0 < row < self.__num_rows - 1 and 0 < col < self.__num_cols - 1:
+            return Location(row, col, self)
+
+        if strict:
+            raise Exception("Location in row %d col %d do not exist." % (row, col))
+        return None
+
+
+class LevelOverlay(object):
+    """View of a Level with cells of its own blocked.
+
+    Walls, corners, distances and moves are the ones of the level. Cells can be
+    blocked (e.g. by actors a sub-search must go around): the view only keeps the
+    set of blocked cells, which the state searches take as obstacles (see
+    StateContext and GroupPlanner). The wall mask is the level's, without them.
+    """
+
+    def __init__(self, level: Level):
+        self.__level = level
+        self.__blocked = set()
+
+    def __getattr__(self, name):
+        # Everything else comes from the level
+        if name.startswith('_LevelOverlay__'):
+            raise AttributeError(name)
+        return getattr(self.__level, name)
+
+    def __copy__(self):
+        _overlay = LevelOverlay(self.__level)
+        for cell in self.__blocked:
+            _overlay.block(cell)
+        return _overlay
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    def __repr__(self):
+        return 'LevelOverlay(%r, %d blocked)' % (self.__level, len(self.__blocked))
+
+    @property
+    def base(self) -> Level:
+        return self.__level
+
+    @property
+    def blocked(self) -> frozenset:
+        return frozenset(self.__blocked)
+
+    def block(self, cell: int):
+        """Make a cell an obstacle in this view only.
+        """
+        self.__blocked.add(cell)
+
+    def overlay(self) -> 'LevelOverlay':
+        return self.__copy__()
@@ -1,31 +1,30 @@
-import numpy as np
+class Location(object):
+    """A cell of a level, seen through its coordinates.
 
+    Locations are light values created on demand by Level (see Level.location_at):
+    whether they are walls, their neighbors and distances all come from the level
+    arrays. Two locations are equal when their coordinates are.
+    """
+    __slots__ = ('__pos_row', '__pos_col', '__level', '_hash')
 
-class Location(object):
-    __pos_row = None
-    __pos_col = None
-    __neighbors = None
-    is_wall = None
-    _hash = None
-    __distances = None
-    
-    def __init__(self, row: int, col: int):
+    def __init__(self, row: int, col: int, level: 'Level' = None):
         self.__pos_row = row  # Y
         self.__pos_col = col  # X
-        self.__neighbors = None
-        self.is_wall = None
+        self.__level = level
         self._hash = None
-        self.__distances = None
 
     def __hash__(self):
         if self._hash is None:
-            prime = 31
-            _hash = 1
-            _hash = _hash * prime + hash(self.__str__())
-            _hash = _hash * prime + hash((self.row, self.col))
-            self._hash = _hash
+            self._hash = hash((self.__pos_row, self.__pos_col))
         return self._hash
 
+    def __copy__(self):
+        # Locations never change, copies can share them
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
     def __repr__(self):
         return self.__str__()
 
@@ -45,76 +44,62 @@ class Location(object):
             raise Exception(
                 'Cannot compare Location with %s.' % type(value)
             )
-        
+
         if (self.row != value.row or self.col != value.col):
             return False
-        
+
         return True
-    
+
     def __lt__(self, other):
         return (self.row + self.col) < (other.row + other.col)
-    
+
+    @property
+    def level(self) -> 'Level':
+        return self.__level
+
     @property
-    def distances(self):
-        return self.__distances
-        
+    def index(self) -> int:
+        """Cell index in the level (see Level.index_of).
+        """
+        return self.__pos_row * self.__level.num_cols + self.__pos_col
+
+    @property
+    def distances(self) -> 'DistanceTable':
+        """Shared table of pre-computed distances (see DistanceTable).
+        """
+        return self.__level.distances
+
     @property
     def row(self):
         # Y
         return self.__pos_row
-    
+
     @property
     def col(self):
         # X
         return self.__pos_col
-        
+
+    @property
+    def is_wall(self):
+        if self.__level is None:
+            return None
+        return self.__level.is_wall(self.index)
+
     @property
     def neighbors(self):
-        return self.__neighbors
-    
-    @neighbors.setter
-    def neighbors(self, value):
-        self.__neighbors = value
-        
+        """Free locations next to this one (None for walls).
+        """
+        if self.is_wall:
+            return None
+        level = self.__level
+        return [level.location_at(cell) for cell in level.neighbors(self.index)]
+
     def is_corner(self):
         """Check whether the position is a corner
         """
-        if self.is_wall or len(self.neighbors) != 2: return False
-        
-        # Building comparable neighbors
-        n_dif = {
-            'r': {Location(self.row, self.col - 1), Location(self.row, self.col + 1)},
-            'c': {Location(self.row - 1, self.col), Location(self.row + 1, self.col)}
-        }
-        
-        cnt = 0
-        
-        # Compare the neighbors and clear
-        for n in self.neighbors:
-            if n in n_dif['r']: 
-                cnt += 1
-                n_dif['r'] = set()
-            
-            if n in n_dif['c']:
-                cnt += 1
-                n_dif['c'] = set()
-        
-        return cnt == 2
-        
-    def build_distance_array(self, rows: int, cols: int):
-        """Precompute Manhattan distance for all points
-
-        Args:
-            rows (int): real number of rows the level has
-            cols (int): real number of cols the level has
-        """
-        self.__distances = np.zeros((rows, cols), dtype=int)
-        
-        for row in range(rows):
-            for col in range(cols):
-                self.__distances[row][col] = abs(col - self.col) + abs(row - self.row)
-        
+        return self.__level.is_corner(self.index)
+
     def distance(self, location: 'Location'):
-        """Pre-computed distance from this location to Y.
+        """Pre-computed (shortest path) distance from this location to Y.
         """
-        return self.distances[location.row][location.col]
+        return self.__level.distances.between(self, location)
@@ -1,19 +1,134 @@
+import os
+import queue
 import logging
+import argparse
+
+from logging.handlers import QueueHandler, QueueListener
 
 from client import Client
 
 
+LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+
+def start_logging(level: str, filename: str) -> QueueListener:
+    """Log records of the given level and above to the file, from a background thread.
+
+    Records are only formatted once they pass the level, and the file is written by
+    a QueueListener thread, so the client never waits for it.
+
+    Returns:
+        QueueListener: to stop once done (None if logging is off)
+    """
+    if level == 'off':
+        logging.disable(logging.CRITICAL)
+        return None
+
+    handler = logging.FileHandler(filename, delay=True)
+    handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(asctime)s: %(message)s"))
+
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, handler)
+    listener.start()
+
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(records))
+    root.setLevel(LOG_LEVELS[level])
+    return listener
+
+
 if __name__ == '__main__':
-    logging.basicConfig(
-        format="%(levelname)s:%(name)s:%(asctime)s: %(message)s",
-        filename='client.log',
-        level=logging.DEBUG,
-        # datefmt="%Y-%m-%d %H:%M:%S"
+    parser = argparse.ArgumentParser(description='WESDONK search client.')
+    parser.add_argument(
+        '--distances', choices=('auto', 'eager', 'lazy'), default='auto',
+        help='compute the distance table at start up (eager) or row by row on first use (lazy)'
+    )
+    parser.add_argument(
+        '--route-cache', type=int, default=4096, metavar='N',
+        help='maximum number of routes kept in the route cache (0 disables it)'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1, metavar='N',
+        help='worker processes expanding states in the state search (default: 1, no workers)'
+    )
+    parser.add_argument(
+        '--search', choices=('joint', 'decomposition'), default='joint',
+        help='state search engine: joint actions, or operator decomposition with independence detection'
+    )
+    parser.add_argument(
+        '--planner', choices=('greedy', 'cbs'), default='greedy',
+        help='planner: agents one after the other (greedy), or all at once with Conflict-Based Search '
+             '(falls back to greedy when no plan is found)'
     )
+    parser.add_argument(
+        '--routes', choices=('independent', 'cooperative'), default='independent',
+        help='greedy planner routes: planned independently and padded with waits, or planned in '
+             'space-time around the cells reserved by the agents planned before (cooperative A*)'
+    )
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='send joint actions as soon as they are final (with cooperative routes, after every planning '
+             'round) and read the server responses in the background'
+    )
+    parser.add_argument(
+        '--memory', type=float, default=None, metavar='MB',
+        help='memory budget of the state search in MB (default: none)'
+    )
+    parser.add_argument(
+        '--bounded', choices=('beam', 'ida'), default='beam',
+        help='state search once over the memory budget: keep only the best states of the frontier (beam), '
+             'or start over with IDA*, whose memory grows with the plan length only'
+    )
+    parser.add_argument(
+        '--anytime', type=float, default=None, metavar='SECONDS',
+        help='anytime state search (ARA*): find a first plan quickly, then improve it for up to '
+             'SECONDS per state search (default: off, the first plan found is used)'
+    )
+    parser.add_argument(
+        '--weight', type=float, default=5.0, metavar='W',
+        help='heuristic weight of the first anytime search iteration, lowered down to 1 (default: 5)'
+    )
+    parser.add_argument(
+        '--metrics', default=None, metavar='FILE',
+        help='append search metrics (counters, timers, memory) to FILE as JSON lines (default: off)'
+    )
+    parser.add_argument(
+        '--metrics-interval', type=float, default=1.0, metavar='SECONDS',
+        help='minimum seconds in between two progress records of --metrics (default: 1)'
+    )
+    parser.add_argument(
+        '--profile', default=os.environ.get('WESDONK_PROFILE'), metavar='DIR',
+        help='profile the client with cProfile, writing DIR/<level name>.prof (default: $WESDONK_PROFILE, or off)'
+    )
+    parser.add_argument(
+        '--profile-memory', type=int, default=int(os.environ.get('WESDONK_PROFILE_MEMORY', 0)), metavar='N',
+        help='with --profile, also trace allocations and write the top N lines at every state search '
+             'to DIR/<level name>.alloc.txt (default: $WESDONK_PROFILE_MEMORY, or 0 for off)'
+    )
+    parser.add_argument(
+        '--log-level', choices=('debug', 'info', 'warning', 'error', 'off'),
+        default=os.environ.get('WESDONK_LOG', 'warning'),
+        help='lowest level of the messages written to the log file (default: $WESDONK_LOG, or warning)'
+    )
+    parser.add_argument(
+        '--log-file', default='client.log', metavar='FILE', help='log file (default: client.log)'
+    )
+    options = vars(parser.parse_args())
+    
+    listener = start_logging(options.pop('log_level'), options.pop('log_file'))
     logging.debug("##########\n")
     logging.debug("Session started.")
     
-    Client.boot_up()
-    
-    logging.debug("Session ended.")
-    logging.debug("\n##########")
+    try:
+        Client.boot_up(options)
+    finally:
+        logging.debug("Session ended.")
+        logging.debug("\n##########")
+        
+        if listener:
+            listener.stop()
@@ -1,31 +1,30 @@
-import time
+import os
 import psutil
-import sys
 
 from math import inf
 
 _max_usage = inf
-_process = psutil.Process()
-_start_time = time.perf_counter()
+_process = None  # This process, resolved on first use (see get_usage)
+
+CHECK_EVERY = 256  # Iterations in between two memory usage checks (see is_over_budget)
 
 
 def get_usage() -> 'float':
-    ''' Returns memory usage of current process in MB. '''
+    ''' Returns memory usage of current process in MB.
+    The process is looked up again in a forked child, which would see its parent otherwise. '''
     global _process
+    if _process is None or _process.pid != os.getpid():
+        _process = psutil.Process()
     return _process.memory_info().rss / (1024*1024)
 
-def print_search_status(explored, frontier):
-    status_template = '#Expanded: {:8,}, #Frontier: {:8,}, #Generated: {:8,}, Time: {:3.3f} s\n[Alloc: {:4.2f} MB, MaxAlloc: {:4.2f} MB]'
-    elapsed_time = time.perf_counter() - _start_time
-    print(
-        status_template.format(
-            len(explored),
-            frontier.qsize(),
-            len(explored) + frontier.qsize(),
-            elapsed_time,
-            get_usage(),
-            _max_usage
-        ),
-        file=sys.stderr,
-        flush=True
-    )
+def set_max_usage(megabytes: float = None):
+    ''' Sets the memory budget in MB (None for no budget). '''
+    global _max_usage
+    _max_usage = inf if megabytes is None else megabytes
+
+def is_over_budget(iteration: int) -> 'bool':
+    ''' Whether the process takes more memory than the budget.
+    Checked only every CHECK_EVERY iterations: reading the usage is a system call. '''
+    if _max_usage == inf or iteration % CHECK_EVERY:
+        return False
+    return get_usage() > _max_usage
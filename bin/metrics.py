@@ -0,0 +1,107 @@
+import json
+import time
+import logging
+
+import memory
+
+
+log = logging.getLogger(__name__)
+
+
+class SearchMetrics(object):
+    """Counters, timers and sampled gauges of the state searches of a client.
+
+    Counters and timers are plain dict entries the searches add to, so keeping
+    them costs next to nothing. The memory gauge is only read every
+    memory.CHECK_EVERY iterations (see sample), and records are emitted at most
+    once per interval, as JSON lines to a file and/or to a callback taking the record.
+
+    Counters:
+        expanded: states taken out of the frontier
+        generated: successors of the expanded states
+        duplicates: successors already explored
+        deadlocks: box moves onto dead squares, not generated (see DeadlockTable)
+
+    Timers (seconds):
+        expansion: generating successors
+        heuristic: evaluating successors
+        hashing: looking successors up in the explored set
+    """
+    COUNTERS = ('expanded', 'generated', 'duplicates', 'deadlocks')
+    TIMERS = ('expansion', 'heuristic', 'hashing')
+
+    def __init__(self, path: str = None, callback=None, interval: float = 1.0):
+        """
+        Args:
+            path (str, optional): JSON-lines file the records are appended to
+            callback (callable, optional): called with every record (a dict)
+            interval (float, optional): minimum seconds in between two progress records
+        """
+        self.counters = dict.fromkeys(SearchMetrics.COUNTERS, 0)
+        self.timers = dict.fromkeys(SearchMetrics.TIMERS, 0.0)
+        self.gauges = {'rss_mb': 0.0, 'peak_rss_mb': 0.0}
+        self.searches = 0
+
+        self.__file = open(path, 'a') if path else None
+        self.__callback = callback
+        self.__interval = interval
+        self.__start = time.perf_counter()
+        self.__last = self.__start
+
+    @property
+    def enabled(self) -> bool:
+        """Whether records go anywhere.
+        """
+        return self.__file is not None or self.__callback is not None
+
+    def sample(self, iteration: int):
+        """Read the memory gauge every memory.CHECK_EVERY iterations, and emit
+        a progress record if the interval has passed since the last one.
+        """
+        if iteration % memory.CHECK_EVERY:
+            return
+
+        self.measure()
+
+        if self.enabled and time.perf_counter() - self.__last >= self.__interval:
+            self.emit('progress')
+
+    def measure(self):
+        """Read the memory gauge now.
+        """
+        rss = memory.get_usage()
+        self.gauges['rss_mb'] = rss
+        self.gauges['peak_rss_mb'] = max(self.gauges['peak_rss_mb'], rss)
+
+    def record(self, event: str, **fields) -> dict:
+        """Snapshot of every counter, timer and gauge.
+        """
+        record = {'event': event, 'time': round(time.perf_counter() - self.__start, 6), 'searches': self.searches}
+        record.update(self.counters)
+        record.update(('%s_s' % name, round(seconds, 6)) for name, seconds in self.timers.items())
+        record.update(self.gauges)
+        record.update(fields)
+        return record
+
+    def emit(self, event: str, **fields):
+        """Send a record (see record) to the file and the callback.
+        """
+        if not self.enabled:
+            return
+
+        record = self.record(event, **fields)
+        self.__last = time.perf_counter()
+
+        if self.__file is not None:
+            self.__file.write(json.dumps(record, default=str) + '\n')
+        if self.__callback is not None:
+            self.__callback(record)
+
+    def close(self):
+        """Emit the last record and close the file.
+        """
+        self.emit('end')
+
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
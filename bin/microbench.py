@@ -0,0 +1,162 @@
+"""Micro-benchmarks for the search internals, in this process and without a server.
+Whole runs of the client over a corpus of levels are benchmarked by bench.py.
+
+Usage:
+    $ python bin/microbench.py levels/SAsoko1_*.lvl
+    $ python bin/microbench.py --planner levels/MAthomasAppartment_redpurple.lvl
+
+Every level is loaded straight from its file (no server needed), boxes get their
+destinations as in the controller (see GoalAssignment) and the state search is run with each
+open list for a fixed budget of expansions (or time), reporting expansions per second.
+
+With --planner, the whole greedy planner runs instead (actions are not sent
+anywhere) and the time of the state search of every desire is reported.
+"""
+import sys
+import time
+import argparse
+
+from queue import PriorityQueue
+
+from client import Client
+from controller import Controller
+from assignment import GoalAssignment
+from frontier import Frontier
+from state import State
+
+
+def load_level(path: str):
+    """Parse a level file and give every box a destination and every agent a desire.
+
+    Returns:
+        tuple: level, agents, boxes, goals
+    """
+    with open(path) as level_file:
+        configuration = Client.parse_level(level_file)
+
+    level, agents, boxes, goals = configuration.build_structure()
+
+    for box, destination in GoalAssignment(level, goals).assign(boxes):
+        box.destination = destination
+
+    for agent in agents:
+        agent.goals = sorted(
+            (box for box in boxes if box.color == agent.color and box.destination),
+            key=lambda box: agent.distance(box.location)
+        )
+        agent.update_desire()
+
+    return level, agents, boxes, goals
+
+
+def legacy_search(state: State, max_expansions: int, max_time: float) -> int:
+    """State search as it was done before Frontier: PriorityQueue and a linear membership scan.
+    """
+    frontier = PriorityQueue()
+    frontier.put((0, state))
+    explored = set()
+    expansions = 0
+    deadline = time.perf_counter() + max_time
+
+    while not frontier.empty() and expansions < max_expansions and time.perf_counter() < deadline:
+        _, state = frontier.get()
+
+        if state.is_goal_state():
+            break
+
+        explored.add(state)
+        expansions += 1
+
+        for n in state.get_expanded_states():
+            rnode = n.h, n
+            if not (rnode in frontier.queue or n in explored):
+                frontier.put(rnode)
+
+    return expansions
+
+
+def frontier_search(state: State, max_expansions: int, max_time: float) -> int:
+    """State search as done by Controller: indexed Frontier.
+    """
+    frontier = Frontier()
+    frontier.put(0, state)
+    explored = set()
+    expansions = 0
+    deadline = time.perf_counter() + max_time
+
+    while frontier and expansions < max_expansions and time.perf_counter() < deadline:
+        _, state = frontier.get()
+
+        if state.is_goal_state():
+            break
+
+        explored.add(state)
+        expansions += 1
+
+        for n in state.get_expanded_states():
+            if n not in explored:
+                frontier.put(n.h, n)
+
+    return expansions
+
+
+SEARCHES = (
+    ('PriorityQueue', legacy_search),
+    ('Frontier', frontier_search),
+)
+
+
+def bench_open_lists(paths: [str, ...], max_expansions: int, max_time: float):
+    header = '{:<24}' + '{:>22}' * len(SEARCHES)
+    print(header.format('level', *('%s exp/s' % name for name, _ in SEARCHES)))
+
+    for path in paths:
+        rates = []
+
+        for _, search in SEARCHES:
+            state = State.from_actors(*load_level(path))
+            start = time.perf_counter()
+            expansions = search(state, max_expansions, max_time)
+            elapsed = time.perf_counter() - start
+            rates.append('{:,.0f} ({:,})'.format(expansions / elapsed if elapsed else 0, expansions))
+
+        print(header.format(path.split('/')[-1], *rates), flush=True)
+
+
+def bench_planner(paths: [str, ...]):
+    header = '{:<36}{:>10}{:>12}{:>12}{:>12}{:>12}'
+    print(header.format('level', 'desires', 'total s', 'search s', 'mean ms', 'max ms'))
+    send_to_server = Client.send_to_server
+    Client.send_to_server = staticmethod(lambda actions, on_failure=None, lookahead=None: True)
+
+    try:
+        for path in paths:
+            with open(path) as level_file:
+                controller = Controller(Client.parse_level(level_file))
+
+            start = time.perf_counter()
+            controller.deploy()
+            elapsed = time.perf_counter() - start
+
+            times = [seconds for _, _, seconds in controller.desire_times]
+            print(header.format(
+                path.split('/')[-1], len(times), '%.3f' % elapsed, '%.3f' % sum(times),
+                '%.2f' % (1000 * sum(times) / len(times) if times else 0), '%.2f' % (1000 * max(times, default=0))
+            ), flush=True)
+    finally:
+        Client.send_to_server = send_to_server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search micro-benchmarks.')
+    parser.add_argument('levels', nargs='+', help='level files, e.g. levels/SAsoko1_*.lvl')
+    parser.add_argument('-n', '--expansions', type=int, default=5000, help='maximum expansions per search')
+    parser.add_argument('-t', '--time', type=float, default=10.0, help='maximum seconds per search')
+    parser.add_argument('--planner', action='store_true', help='time the greedy planner per desire instead')
+    args = parser.parse_args()
+
+    if args.planner:
+        bench_planner(args.levels)
+    else:
+        bench_open_lists(args.levels, args.expansions, args.time)
+    sys.exit(0)
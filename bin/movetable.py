@@ -0,0 +1,98 @@
+import logging
+import numpy as np
+
+from action import Action, ActionType
+
+
+log = logging.getLogger(__name__)
+
+
+class MoveTable(object):
+    """Pre-computed outcome of every Action from every free cell.
+
+    For a cell and an action, the table holds the cell the agent ends up in,
+    the cell the box is taken from and the cell the box ends up in
+    (or -1 when there is no box involved). An action that would take the agent
+    or the box into a wall is not valid and has -1 everywhere.
+    Cells are the flat cell indexes used by Level (row * num_cols + col).
+
+    Only walls are taken into account: whether cells are occupied is up to the caller.
+    """
+    ACTIONS = tuple(Action)
+    AGENT_TO, BOX_FROM, BOX_TO = range(3)
+
+    def __init__(self, walls: bytearray, num_rows: int, num_cols: int):
+        num_cells = num_rows * num_cols
+        self.__index = {action: n for n, action in enumerate(MoveTable.ACTIONS)}
+
+        # Offsets (agent to, box from, box to) of every action
+        offsets = np.array([MoveTable.__offsets(action, num_cols) for action in MoveTable.ACTIONS])
+        has_box = np.array([action.type in (ActionType.Push, ActionType.Pull) for action in MoveTable.ACTIONS])
+
+        is_free = np.frombuffer(bytes(walls), dtype=np.uint8) == 0
+        cells = np.arange(num_cells)[:, None, None]
+        table = cells + offsets[None, :, :]
+
+        def free(index):
+            return is_free[np.clip(index, 0, num_cells - 1)] & (index >= 0) & (index < num_cells)
+
+        valid = is_free[:, None] & free(table[:, :, MoveTable.AGENT_TO]) & (
+            ~has_box | (free(table[:, :, MoveTable.BOX_FROM]) & free(table[:, :, MoveTable.BOX_TO]))
+        )
+
+        table[:, ~has_box, MoveTable.BOX_FROM:] = -1
+        table[~valid] = -1
+        self.__table = table.astype(np.int32)
+
+        # Valid moves per cell: ((Action, agent to, box from, box to), ...), NoOp first
+        self.__moves = [() for _ in range(num_cells)]
+        valid_cells, valid_actions = np.nonzero(valid)
+        outcomes = self.__table[valid_cells, valid_actions].T.tolist()
+        entries = list(zip([MoveTable.ACTIONS[n] for n in valid_actions.tolist()], *outcomes))
+        ends = np.cumsum(valid.sum(axis=1)).tolist()
+
+        for cell in np.flatnonzero(is_free).tolist():
+            self.__moves[cell] = tuple(entries[ends[cell - 1] if cell else 0:ends[cell]])
+
+        log.debug("Move table for %d cells.", num_cells)
+
+    def __deepcopy__(self, memo):
+        # Static data, shared by every copy of the level
+        return self
+
+    @staticmethod
+    def __offsets(action: Action, num_cols: int) -> (int, int, int):
+        agent_to = action.agent_row_delta * num_cols + action.agent_col_delta
+        box_delta = action.box_row_delta * num_cols + action.box_col_delta
+
+        if action.type is ActionType.Push:
+            return agent_to, agent_to, agent_to + box_delta
+
+        if action.type is ActionType.Pull:
+            # The box comes from the opposite side of its move, into the agent cell
+            return agent_to, -box_delta, 0
+
+        # NoOp and Move (box offsets are not used)
+        return agent_to, 0, 0
+
+    @property
+    def table(self) -> np.ndarray:
+        """(cells, actions, 3) array: agent to, box from, box to (-1 if invalid or no box).
+        """
+        return self.__table
+
+    @property
+    def moves(self) -> [((Action, int, int, int), ...), ...]:
+        """Valid moves of every cell, indexed by cell.
+        """
+        return self.__moves
+
+    def outcome(self, cell: int, action: Action) -> (int, int, int):
+        """Agent to, box from and box to cells of an action.
+        """
+        return tuple(int(c) for c in self.__table[cell, self.__index[action]])
+
+    def agent_to(self, cell: int, action: Action) -> int:
+        """Cell the agent ends up in after the action (-1 if not valid).
+        """
+        return int(self.__table[cell, self.__index[action], MoveTable.AGENT_TO])
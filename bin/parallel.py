@@ -0,0 +1,100 @@
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+
+from state import State, StateContext
+
+
+log = logging.getLogger(__name__)
+
+
+# StateContext of the search, set once in every worker process
+_context = None
+
+
+def _init_worker(context: StateContext):
+    global _context
+    _context = context
+
+
+def _expand(batch: [(tuple, tuple, int), ...]) -> [[(tuple, tuple, tuple, int), ...], ...]:
+    """Expand a batch of states given as (agents, boxes, g).
+
+    Returns:
+        list: for every state, its successors as (agents, boxes, joint actions, h, hash)
+    """
+    expanded = []
+
+    for agents, boxes, g in batch:
+        state = State(_context, agents, boxes)
+        state._g = g
+        expanded.append([
+            (n.agents, n.boxes, n._joint_actions, n.h, n._hash) for n in state.get_expanded_states()
+        ])
+
+    return expanded
+
+
+class ParallelExpander(object):
+    """Expands states and evaluates the heuristic of their successors in worker processes.
+
+    States travel in their compact form (cell index tuples); the static StateContext
+    is sent once to every worker when the pool starts. Results come back in the
+    order the states were given, so searches stay deterministic.
+    """
+    CHUNK_SIZE = 16  # States sent to a worker at once
+
+    def __init__(self, context: StateContext, workers: int, chunk_size: int = CHUNK_SIZE):
+        self.__context = context
+        self.__workers = workers
+        self.__chunk_size = chunk_size
+        self.__pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(context, )
+        )
+        log.debug("Started %d search workers.", workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    @property
+    def batch_size(self) -> int:
+        """Number of states worth sending to the pool at once.
+        """
+        return self.__workers * self.__chunk_size
+
+    def shutdown(self):
+        self.__pool.shutdown(cancel_futures=True)
+
+    def expand(self, states: [State, ...]) -> [[State, ...], ...]:
+        """Successors of each of the given states (same as State.get_expanded_states).
+        """
+        size = self.__chunk_size
+        chunks = [
+            [(s.agents, s.boxes, s._g) for s in states[n:n + size]] for n in range(0, len(states), size)
+        ]
+
+        expanded = []
+        parents = iter(states)
+
+        for chunk in self.__pool.map(_expand, chunks):
+            for successors in chunk:
+                parent = next(parents)
+                _states = []
+
+                for agents, boxes, joint_actions, h, key in successors:
+                    _state = State(self.__context, agents, boxes)
+                    _state._joint_actions = joint_actions
+                    _state._parent = parent
+                    _state._g = parent._g + 1
+                    _state._h = h
+                    _state._hash = key
+                    _states.append(_state)
+
+                expanded.append(_states)
+
+        return expanded
@@ -0,0 +1,123 @@
+"""Profiling mode of the client (--profile, or the WESDONK_PROFILE environment variable).
+
+Controller.deploy runs under cProfile, and the profile of every level goes to
+<directory>/<level name>.prof. With --profile-memory N (or WESDONK_PROFILE_MEMORY),
+tracemalloc also runs and a snapshot is taken at every state search: the top N
+allocating lines of each go to <directory>/<level name>.alloc.txt.
+
+Profiles of many levels (e.g. of a benchmark run) are aggregated with:
+    $ python bin/profiling.py profiles/ [-n 40] [--sort tottime]
+"""
+import os
+import re
+import sys
+import pstats
+import cProfile
+import logging
+import argparse
+import tracemalloc
+
+
+log = logging.getLogger(__name__)
+
+_top = 0
+_reports = []
+_profiler = None
+
+
+def deploy(controller: 'Controller', configuration: 'Configuration'):
+    """Deploy the controller, profiled if the options say so (see profile).
+    """
+    options = configuration.options
+
+    if not options['profile']:
+        return controller.deploy()
+    return profile(controller.deploy, options['profile'], configuration.name, options['profile_memory'])
+
+
+def profile(function, directory: str, name: str, top: int = 0):
+    """Call function under cProfile (and tracemalloc if top), then dump the reports.
+
+    Args:
+        directory (str): where the reports go (created if needed)
+        name (str): level name, the reports are named after it
+        top (int, optional): allocating lines reported per snapshot (0: no tracemalloc)
+    """
+    global _top, _profiler
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, re.sub(r'[^\w.-]', '_', name or 'level'))
+    _top = top
+    _reports.clear()
+
+    if top:
+        tracemalloc.start()
+
+    _profiler = cProfile.Profile()
+
+    try:
+        return _profiler.runcall(function)
+    finally:
+        _profiler.dump_stats(path + '.prof')
+        _profiler = None
+        log.debug("Profile written to %s.prof.", path)
+
+        if top:
+            snapshot('end')
+            tracemalloc.stop()
+
+            with open(path + '.alloc.txt', 'w') as report:
+                report.write('\n\n'.join(_reports) + '\n')
+            log.debug("Allocations written to %s.alloc.txt.", path)
+
+        _top = 0
+
+
+def snapshot(label: str):
+    """Report the top allocating lines now, if tracemalloc runs for a profile.
+    The time it takes is left out of the profile.
+    """
+    if not _top or not tracemalloc.is_tracing():
+        return
+
+    profiler = _profiler
+    if profiler is not None:
+        profiler.disable()
+
+    try:
+        current, peak = tracemalloc.get_traced_memory()
+        statistics = [
+            stat for stat in tracemalloc.take_snapshot().statistics('lineno')
+            if not stat.traceback[0].filename.startswith(('<frozen importlib', tracemalloc.__file__, cProfile.__file__))
+        ]
+
+        lines = ['## %s: %.2f MB traced, %.2f MB peak' % (label, current / 2 ** 20, peak / 2 ** 20)]
+        lines += [str(stat) for stat in statistics[:_top]]
+        _reports.append('\n'.join(lines))
+    finally:
+        if profiler is not None:
+            profiler.enable()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregate the profiles of many levels.')
+    parser.add_argument('paths', nargs='+', help='.prof files or directories of them')
+    parser.add_argument('-n', '--top', type=int, default=40, help='functions shown (default: 40)')
+    parser.add_argument(
+        '--sort', default='cumulative', help='pstats sort key, e.g. tottime, calls (default: cumulative)'
+    )
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.prof'))
+        else:
+            files.append(path)
+
+    if not files:
+        sys.exit('No profile found.')
+
+    stats = pstats.Stats(*files)
+    print('%d profiles.' % len(files))
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
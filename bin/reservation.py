@@ -0,0 +1,128 @@
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class ReservationTable(object):
+    """Cells reserved by actors at given time steps, for cooperative pathfinding.
+
+    Moving actors reserve (cell, time step) pairs, kept in a ring buffer with one
+    slot per time step. Only time steps from the origin on are kept: advance()
+    moves the origin once no plan can start earlier, so memory follows the span
+    of time steps still being planned, not the length of the whole plan.
+    The ring only grows when a single reservation goes further than it holds.
+
+    Actors standing still (boxes nobody moves, agents done with their plan) rest
+    in a cell from a time step on, until they leave it, without taking one entry
+    per time step.
+
+    Owners are plain ints (e.g. id() of the actor). Lookups are O(1): one dict
+    lookup in the slot of the time step, plus the few rest intervals of the cell.
+    """
+    WINDOW = 64  # Initial number of time steps in the ring
+
+    def __init__(self, window: int = WINDOW):
+        self.__slots = [{} for _ in range(window)]  # time % window: {cell: owner}
+        self.__origin = 0  # First time step kept
+        self.__end = 0  # Time steps from here on have no move reservations
+        self.__rests = {}  # cell: [[owner, since, until], ...], until is None while resting
+
+    @property
+    def origin(self) -> int:
+        return self.__origin
+
+    @property
+    def horizon(self) -> int:
+        """First time step after the last move reservation. From there on only
+        rests are left, so the table does not change with time anymore.
+        """
+        return self.__end
+
+    @property
+    def window(self) -> int:
+        return len(self.__slots)
+
+    def __grow(self, t: int):
+        size = len(self.__slots)
+        _size = max(2 * size, t - self.__origin + 1)
+        slots = [{} for _ in range(_size)]
+
+        for _t in range(self.__origin, self.__end):
+            slots[_t % _size] = self.__slots[_t % size]
+
+        self.__slots = slots
+        log.debug("Reservation window grown to %d time steps.", _size)
+
+    def reserve(self, cell: int, t: int, owner: int):
+        """Reserve a cell at a time step. Time steps before the origin are ignored.
+        """
+        if t < self.__origin:
+            return
+
+        if t >= self.__origin + len(self.__slots):
+            self.__grow(t)
+
+        if t >= self.__end:
+            for _t in range(self.__end, t):
+                self.__slots[_t % len(self.__slots)].clear()
+            self.__slots[t % len(self.__slots)].clear()
+            self.__end = t + 1
+
+        self.__slots[t % len(self.__slots)][cell] = owner
+
+    def rest(self, cell: int, since: int, owner: int):
+        """Reserve a cell from a time step on, until the owner leaves it.
+        """
+        self.__rests.setdefault(cell, []).append([owner, since, None])
+
+    def leave(self, cell: int, t: int, owner: int):
+        """End the rest of an owner in a cell: the cell is not its anymore from time step t on.
+        """
+        for rest in self.__rests.get(cell, ()):
+            if rest[0] == owner and rest[2] is None:
+                rest[2] = max(t, rest[1])
+
+    def is_free(self, cell: int, t: int, ignore=()) -> bool:
+        """Whether no one but the ignored owners has the cell at the time step.
+        """
+        if self.__origin <= t < self.__end:
+            owner = self.__slots[t % len(self.__slots)].get(cell)
+
+            if owner is not None and owner not in ignore:
+                return False
+
+        for owner, since, until in self.__rests.get(cell, ()):
+            if since <= t and (until is None or t < until) and owner not in ignore:
+                return False
+
+        return True
+
+    def advance(self, origin: int):
+        """Forget the time steps before the given one.
+        """
+        if origin <= self.__origin:
+            return
+
+        for t in range(self.__origin, min(origin, self.__end)):
+            self.__slots[t % len(self.__slots)].clear()
+
+        self.__origin = origin
+        self.__end = max(self.__end, origin)
+
+        for cell in list(self.__rests):
+            rests = [rest for rest in self.__rests[cell] if rest[2] is None or rest[2] > origin]
+
+            if rests:
+                self.__rests[cell] = rests
+            else:
+                del self.__rests[cell]
+
+    def stats(self) -> dict:
+        return {
+            'origin': self.__origin,
+            'horizon': self.__end,
+            'window': len(self.__slots),
+            'reserved': sum(len(slot) for slot in self.__slots),
+            'resting': sum(len(rests) for rests in self.__rests.values()),
+        }
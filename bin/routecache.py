@@ -0,0 +1,67 @@
+import logging
+
+from collections import OrderedDict
+
+
+log = logging.getLogger(__name__)
+
+
+class RouteCache(object):
+    """Bounded LRU cache for the routes found by Controller.__find_route.
+
+    Routes are keyed on (start, end). They only go around walls, never around
+    actors, so moving actors does not make them stale and nothing is invalidated:
+    the least recently used routes are evicted once the capacity is reached.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.__capacity = capacity
+        self.__routes = OrderedDict()  # (start, end): route, least recently used first
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.__routes)
+
+    @property
+    def capacity(self):
+        return self.__capacity
+
+    def get(self, start: 'Location', end: 'Location') -> ['Location', ...]:
+        """Cached route from start to end, or None.
+        A copy is returned, so callers can change it freely.
+        """
+        key = (start, end)
+        route = self.__routes.get(key)
+
+        if route is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.__routes.move_to_end(key)
+        return list(route)
+
+    def put(self, start: 'Location', end: 'Location', route: ['Location', ...]):
+        if not self.__capacity:
+            return
+
+        key = (start, end)
+        self.__routes[key] = tuple(route)
+        self.__routes.move_to_end(key)
+
+        while len(self.__routes) > self.__capacity:
+            self.__routes.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self.__routes),
+            'capacity': self.__capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,323 @@
+import logging
+import numpy as np
+
+from operator import itemgetter
+from itertools import chain
+
+from action import Action, ActionType
+from movetable import MoveTable
+
+
+log = logging.getLogger(__name__)
+
+
+def goal_test(targets: tuple):
+    """Fast check of whether actors are at their target cells.
+
+    Args:
+        targets (tuple): target cell of every actor (-1 for none)
+
+    Returns:
+        callable: cells -> bool, True when every actor with a target is on it
+    """
+    indexes = [n for n, target in enumerate(targets) if target >= 0]
+
+    if not indexes:
+        return lambda cells: True
+
+    pick = itemgetter(*indexes)
+    wanted = pick(targets)
+    return lambda cells: pick(cells) == wanted
+
+
+class Simulator(object):
+    """The world as the server sees it, executing joint actions with the server rules.
+
+    Every action is checked against the state before the joint action: agents only
+    move into free cells (so two agents cannot swap places or follow each other),
+    boxes are pushed or pulled by agents of their color only, and actions moving
+    into the same cell or moving the same box fail together. Failed actions do
+    nothing, as NoOp.
+
+    A plan is run at once (see run): the positions of the agents for the whole plan
+    come from a cumulative sum of the moves, the positions of the boxes from their
+    moves only, and the rules are checked for every step with array operations.
+    Only from a rejected action on does the rest of the plan have to be run again, so
+    steps are checked in windows that grow while no action is rejected.
+    """
+    CODES = {id(action): n for n, action in enumerate(MoveTable.ACTIONS)}  # Actions are singletons, ids hash fast
+    NOOP = CODES[id(Action.NoOp)]
+    WINDOW = 64  # Steps checked at once after a rejected action, doubled while none is rejected
+
+    def __init__(self, level: 'Level', agents: ['Agent', ...], boxes: ['Box', ...], goals: {'Location': 'Goal'},
+                 agent_cells: [int, ...] = None, box_cells: [int, ...] = None):
+        """
+        Args:
+            agent_cells (list, optional): cells of the agents. Defaults to their location.
+            box_cells (list, optional): cells of the boxes. Defaults to their location.
+        """
+        num_cols = level.num_cols
+        self.__table = level.moves.table
+        self.__num_cells = self.__table.shape[0]
+        self.__move = np.array([
+            action.agent_row_delta * num_cols + action.agent_col_delta for action in MoveTable.ACTIONS
+        ], dtype=np.int64)
+        self.__kind = np.array([action.type.value for action in MoveTable.ACTIONS])
+
+        if agent_cells is None:
+            agent_cells = [level.index_of(agent.location) for agent in agents]
+        if box_cells is None:
+            box_cells = [level.index_of(box.location) for box in boxes]
+
+        self.__agents = np.array(agent_cells, dtype=np.int64)
+        self.__boxes = np.array(box_cells, dtype=np.int64)
+
+        colors = {}
+        self.__agent_colors = np.array([colors.setdefault(agent.color, len(colors)) for agent in agents])
+        self.__box_colors = np.array([colors.setdefault(box.color, len(colors)) for box in boxes] + [-1])
+        self.__box_letters = np.array([ord(str(box.identifier)) for box in boxes], dtype=np.uint8)
+
+        # Box goals by letter, agent goals by agent
+        numbers = [str(agent.identifier) for agent in agents]
+        box_goals = [(level.index_of(loc), ord(str(goal.identifier)))
+                     for loc, goal in goals.items() if not str(goal.identifier).isdigit()]
+        agent_goals = [(numbers.index(str(goal.identifier)), level.index_of(loc))
+                       for loc, goal in goals.items() if str(goal.identifier) in numbers]
+
+        self.__goal_cells, self.__goal_letters = np.array(box_goals, dtype=np.int64).reshape(-1, 2).T
+        self.__goal_agents, self.__goal_agent_cells = np.array(agent_goals, dtype=np.int64).reshape(-1, 2).T
+
+    @staticmethod
+    def from_state(state: 'State', goals: {'Location': 'Goal'}) -> 'Simulator':
+        """Simulator of the world of a search state (see StateContext).
+        """
+        context = state.context
+        return Simulator(context.level, context.agents, context.boxes, goals, state.agents, state.boxes)
+
+    @property
+    def agents(self) -> (int, ...):
+        """Cells of the agents.
+        """
+        return tuple(self.__agents.tolist())
+
+    @property
+    def boxes(self) -> (int, ...):
+        """Cells of the boxes.
+        """
+        return tuple(self.__boxes.tolist())
+
+    @property
+    def is_solved(self) -> bool:
+        """Whether every goal of the level is met.
+        """
+        letters = np.zeros(self.__num_cells, dtype=np.uint8)
+        letters[self.__boxes] = self.__box_letters
+
+        return bool(
+            np.all(letters[self.__goal_cells] == self.__goal_letters) and
+            np.all(self.__agents[self.__goal_agents] == self.__goal_agent_cells)
+        )
+
+    def step(self, joint_action: [Action, ...]) -> [bool, ...]:
+        """Execute a joint action.
+
+        Returns:
+            list: whether the action of each agent succeeded, as the server responds
+        """
+        return self.run([joint_action])[0].tolist()
+
+    def run(self, plan: [[Action, ...], ...]) -> np.ndarray:
+        """Execute joint actions one after the other.
+
+        Returns:
+            np.ndarray: (steps, agents) bool array, whether each action succeeded
+        """
+        num_actions = len(plan) * len(self.__agents)
+        codes = np.fromiter(
+            map(Simulator.CODES.__getitem__, map(id, chain.from_iterable(plan))), dtype=np.int64, count=num_actions
+        ).reshape(len(plan), len(self.__agents))
+        results = np.ones(codes.shape, dtype=bool)
+        offset = 0
+        window = Simulator.WINDOW
+
+        while offset < len(codes):
+            failed_at, failed = self.__execute(codes[offset:offset + window])
+
+            if failed_at is None:
+                offset += window
+                window *= 2
+                continue
+
+            # Up to the rejected step, the world is where __execute left it: carry on without the failed actions
+            offset += failed_at
+            results[offset] = ~failed
+            codes[offset, failed] = Simulator.NOOP
+            window = max(Simulator.WINDOW, 2 * failed_at)
+
+        return results
+
+    def follow(self, plan: [[Action, ...], ...]):
+        """Execute joint actions as planned: every action valid on its own (see MoveTable)
+        takes effect, whatever the other agents do. The world ends up where the plan
+        intends it to be, even when the server would reject some of the actions.
+        """
+        table = self.__table
+        agents = self.__agents.tolist()
+        box_of = {cell: nb for nb, cell in enumerate(self.__boxes.tolist())}
+
+        for joint_action in plan:
+            moving = []
+
+            for na, action in enumerate(joint_action):
+                agent_to, box_from, box_to = table[agents[na], Simulator.CODES[id(action)]].tolist()
+
+                if agent_to < 0 or (box_from >= 0 and box_from not in box_of):
+                    continue
+
+                agents[na] = agent_to
+                if box_from >= 0:
+                    moving.append((box_of[box_from], box_from, box_to))
+
+            for _, box_from, _ in moving:
+                box_of.pop(box_from, None)
+            for nb, _, box_to in moving:
+                box_of[box_to] = nb
+
+        self.__agents = np.array(agents, dtype=np.int64)
+        for cell, nb in box_of.items():
+            self.__boxes[nb] = cell
+
+    def __execute(self, codes: np.ndarray) -> (int, np.ndarray):
+        """Execute the joint actions up to the first one with a failed action.
+
+        Returns:
+            tuple: the index of that joint action and which of its actions fail, or None, None
+            when every action succeeds. The world is left before it.
+        """
+        num_steps, num_agents = codes.shape
+
+        # Agent cells before every step, as if every action succeeded
+        positions = np.empty((num_steps + 1, num_agents), dtype=np.int64)
+        positions[0] = self.__agents
+        np.cumsum(self.__move[codes], axis=0, out=positions[1:])
+        positions[1:] += self.__agents
+        before = positions[:-1]
+
+        # Every action but NoOp, in step order, and its outcome (-1 when blocked by a wall), see MoveTable
+        steps, agents = np.nonzero(codes != Simulator.NOOP)
+        kind = self.__kind[codes[steps, agents]]
+        push, pull = kind == ActionType.Push.value, kind == ActionType.Pull.value
+        outcome = self.__table[np.clip(before[steps, agents], 0, self.__num_cells - 1), codes[steps, agents]]
+        agent_to, box_from, box_to = outcome.T.astype(np.int64)
+        box_from[~(push | pull)] = -1
+        box_to[~(push | pull)] = -1
+
+        boxes_at, boxes_after = self.__box_timeline(num_steps, steps, box_from, box_to)
+        others = before[steps]
+
+        def free(cells):
+            return (cells >= 0) & (boxes_at(cells, steps) < 0) & ~(cells[:, None] == others).any(axis=1)
+
+        same_color = self.__box_colors[boxes_at(box_from, steps)] == self.__agent_colors[agents]
+        applicable = np.where(
+            push, same_color & free(box_to), np.where(pull, same_color, True) & free(agent_to)
+        )
+
+        # Applicable actions into the same cell, or moving the same box, fail together
+        ok = applicable & ~self.__shared(
+            steps, np.where(applicable, agent_to, -1), np.where(applicable, box_to, -1)
+        ) & ~self.__shared(steps, np.where(applicable, box_from, -1))
+
+        last = int(steps[~ok].min()) if not ok.all() else num_steps
+
+        self.__agents = positions[last].copy()
+        self.__boxes = boxes_after(last)
+
+        if last == num_steps:
+            return None, None
+
+        failed = np.zeros(num_agents, dtype=bool)
+        failed[agents[(steps == last) & ~ok]] = True
+        return last, failed
+
+    def __box_timeline(self, num_steps: int, steps: np.ndarray, box_from: np.ndarray, box_to: np.ndarray):
+        """Where the boxes are during the steps, as if every action succeeded.
+
+        Boxes only move on push and pull actions: they are followed from one to the
+        next, and every cell a box stays in gives a segment (cell, box, first step, last step + 1).
+        A box action with no box to move, or moving a box into an occupied cell, ends the
+        segments: the step is rejected anyway.
+
+        Returns:
+            tuple: boxes_at(cells, steps) -> the box at each cell before each step (-1 for none),
+            and boxes_after(step) -> the cells of the boxes before the step
+        """
+        box_of = dict(zip(self.__boxes.tolist(), range(len(self.__boxes))))
+        start = [0] * len(self.__boxes)
+        segments = []
+        moving = []
+        boxed = box_from >= 0
+
+        for step, from_cell, to_cell in zip(
+                steps[boxed].tolist(), box_from[boxed].tolist(), box_to[boxed].tolist()):
+            if moving and moving[0][0] != step and not Simulator.__move_boxes(moving, box_of, start, segments):
+                break
+
+            nb = box_of.get(from_cell)
+            if nb is None:
+                break
+            moving.append((step, nb, from_cell, to_cell))
+        else:
+            Simulator.__move_boxes(moving, box_of, start, segments)
+
+        segments += [(cell, nb, start[nb], num_steps + 1) for cell, nb in box_of.items()]
+        cells, boxes, first, end = np.array(segments, dtype=np.int64).reshape(-1, 4).T
+        keys = cells * (num_steps + 2) + first
+        order = np.argsort(keys, kind='stable')
+        cells, boxes, first, end, keys = cells[order], boxes[order], first[order], end[order], keys[order]
+
+        def boxes_at(query, query_steps):
+            if not len(keys):
+                return np.full(query.shape, -1)
+
+            n = np.searchsorted(keys, query * (num_steps + 2) + query_steps, side='right') - 1
+            hit = (n >= 0) & (cells[n] == query) & (end[n] > query_steps) & (query >= 0)
+            return np.where(hit, boxes[n], -1)
+
+        def boxes_after(step):
+            current = self.__boxes.copy()
+            now = (first <= step) & (end > step)
+            current[boxes[now]] = cells[now]
+            return current
+
+        return boxes_at, boxes_after
+
+    @staticmethod
+    def __move_boxes(moving: list, box_of: dict, start: list, segments: list) -> bool:
+        """Move the boxes of one step (step, box, from cell, to cell), closing their segments.
+        Returns False, with nothing moved, if a box would be moved twice or into an occupied cell.
+        """
+        if len({nb for _, nb, _, _ in moving}) < len(moving) or any(to in box_of for _, _, _, to in moving):
+            return False
+
+        for step, nb, from_cell, _ in moving:
+            del box_of[from_cell]
+            segments.append((from_cell, nb, start[nb], step + 1))
+
+        for step, nb, _, to_cell in moving:
+            start[nb] = step + 1
+            box_of[to_cell] = nb
+
+        moving.clear()
+        return True
+
+    def __shared(self, steps: np.ndarray, *cells: np.ndarray) -> np.ndarray:
+        """Whether any of the given cells of each action (-1 for none) is also
+        a cell of another action of the same step.
+        """
+        keys = np.concatenate([steps * self.__num_cells + c for c in cells])
+        used = np.concatenate([c >= 0 for c in cells])
+        keys[~used] = -1 - np.arange(np.count_nonzero(~used))
+
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        return (counts[inverse] > 1).reshape(len(cells), -1).any(axis=0)
@@ -1,244 +1,400 @@
-import sys
 import numpy as np
 
-from eprint import deb
-
-from queue import PriorityQueue
-
-from copy import deepcopy
+from copy import copy
 
 from box import Box
 from goal import Goal
 from level import Level
 from agent import Agent
-from color import Color
-from location import Location
 from action import Action, ActionType
+from simulator import goal_test
+
+
+class StateContext(object):
+    """Static part of a state search.
+    Walls, colors, goals and destinations never change during a search, so they
+    are kept here once and shared by every State, which only holds cell indexes.
+    """
+    ZOBRIST_SEED = 0x5EED  # Fixed, so hashes (and searches) are the same every run
+
+    def __init__(self, level: Level, agents: [Agent, ...], boxes: [Box, ...], goals: {'Location': Goal},
+                 agent_targets: ['Location', ...] = None, box_targets: ['Location', ...] = None):
+        """
+        Args:
+            agent_targets (list, optional): where each agent must end up (None for nowhere).
+            Defaults to the location of their current desire.
+            box_targets (list, optional): where each box must end up (None for nowhere).
+            Defaults to their destination.
+        """
+        self.level = level
+        self.moves = level.moves.moves  # Valid moves per cell, see MoveTable
+
+        # Occupancy bitmap and box index per cell. Scratch space filled
+        # and cleared by State.get_expanded_states
+        self.occupied = bytearray(level.num_rows * level.num_cols)
+        self.box_at = [-1] * (level.num_rows * level.num_cols)
+
+        # Cells blocked by a level overlay (see LevelOverlay) stay occupied for the whole search
+        for cell in getattr(level, 'blocked', ()):
+            self.occupied[cell] = 1
+
+        # Actors in the order used by State.agents and State.boxes
+        self.agents = tuple(agents)
+        self.boxes = tuple(boxes)
+
+        self.agent_colors = tuple(agent.color for agent in self.agents)
+        self.box_colors = tuple(box.color for box in self.boxes)
+
+        # Where agents want to be and where boxes must go (-1 if nowhere)
+        if agent_targets is None:
+            agent_targets = [agent.desire.location if agent.desire else None for agent in self.agents]
+        self.agent_targets = tuple(level.index_of(target) if target is not None else -1 for target in agent_targets)
+        if box_targets is None:
+            box_targets = [box.destination for box in self.boxes]
+        self.box_targets = tuple(level.index_of(target) if target is not None else -1 for target in box_targets)
+
+        # Box moves not generated because of dead squares, see State.__is_applicable
+        self.deadlocks = 0
+
+        # Whether agents and boxes are at their targets, see State.is_goal_state
+        self.agents_done = goal_test(self.agent_targets)
+        self.boxes_done = goal_test(self.box_targets)
+
+        # Distances from every cell to the targets above (None if no target)
+        self.agent_distances = tuple(
+            level.distances.distances_to(target) if target >= 0 else None for target in self.agent_targets
+        )
+        self.box_distances = tuple(
+            level.distances.distances_to(target) if target >= 0 else None for target in self.box_targets
+        )
+
+        # Dead squares of every box for its target (None if no target), see DeadlockTable.
+        # Boxes no agent of the search can move and blocked cells never leave their cell.
+        agent_colors = set(self.agent_colors)
+        static = frozenset(getattr(level, 'blocked', ())).union(
+            level.index_of(box.location) for box in self.boxes if box.color not in agent_colors
+        )
+        self.box_dead = tuple(
+            level.deadlocks.dead_squares(target, static) if target >= 0 else None for target in self.box_targets
+        )
+
+        # Zobrist keys: a random 64-bit key per (actor, cell). The hash of a state is the
+        # XOR of the keys of where its actors are, see State.__hash__
+        num_cells = level.num_rows * level.num_cols
+        keys = np.random.default_rng(StateContext.ZOBRIST_SEED).integers(
+            0, 2 ** 64, size=(len(self.agents) + len(self.boxes), num_cells), dtype=np.uint64
+        ).tolist()
+        self.agent_keys = tuple(keys[:len(self.agents)])
+        self.box_keys = tuple(keys[len(self.agents):])
+
+        # Goal cells belonging to other colors, per agent
+        self.other_goals = tuple(
+            frozenset(level.index_of(loc) for loc, goal in goals.items() if goal.color != color)
+            for color in self.agent_colors
+        )
+
+    def __getstate__(self):
+        # Only what is needed to expand states travels to worker processes
+        state = self.__dict__.copy()
+        state.update(level=None, agents=None, boxes=None, agents_done=None, boxes_done=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.agents_done = goal_test(self.agent_targets)
+        self.boxes_done = goal_test(self.box_targets)
+
+    def zobrist(self, agents: tuple, boxes: tuple) -> int:
+        """Zobrist hash of actor positions, computed from scratch.
+        """
+        key = 0
+        for cell, keys in zip(agents, self.agent_keys):
+            key ^= keys[cell]
+        for cell, keys in zip(boxes, self.box_keys):
+            key ^= keys[cell]
+        return key
+
+    def initial_state(self) -> 'State':
+        return State(
+            self,
+            tuple(self.level.index_of(agent.location) for agent in self.agents),
+            tuple(self.level.index_of(box.location) for box in self.boxes)
+        )
 
 
 class State(object):
-    def __init__(self, level: Level, agents: Agent, boxes: Box, goals: Goal):
-        self.__level = level
-        self.__agents = agents
-        self.__boxes = boxes
-        self.__goals = goals
-        
+    """A node in the state search.
+    Agents and boxes are cell indexes in the same order as in the StateContext.
+    The hash is the Zobrist hash of the positions (see StateContext.zobrist),
+    updated from the parent hash for the actors that moved.
+    """
+    __slots__ = ('_context', 'agents', 'boxes', '_joint_actions', '_parent', '_g', '_hash', '_h')
+
+    def __init__(self, context: StateContext, agents: tuple, boxes: tuple):
+        self._context = context
+        self.agents = agents
+        self.boxes = boxes
+
         # Attributes
         self._joint_actions = None
         self._hash = None
         self._parent = None
         self._g = 0
-        
-    @property
-    def agents(self):
-        return self.__agents
-    
+        self._h = None
+
+    @staticmethod
+    def from_actors(level: Level, agents: [Agent, ...], boxes: [Box, ...], goals: {'Location': Goal},
+                    agent_targets: ['Location', ...] = None) -> 'State':
+        """Build the initial state of a search from actor objects (see StateContext).
+        """
+        return StateContext(level, agents, boxes, goals, agent_targets).initial_state()
+
     @property
-    def boxes(self):
-        return self.__boxes
-        
+    def context(self) -> StateContext:
+        return self._context
+
     def __hash__(self):
         if self._hash is None:
-            prime = 71
-            _hash = 1
-            _hash = _hash * prime + hash(tuple(self.agents))
-            _hash = _hash * prime + hash(tuple(self.boxes))
-            _hash = _hash * prime + self._g
-            self._hash = _hash
+            self._hash = self._context.zobrist(self.agents, self.boxes)
         return self._hash
-    
+
     def __eq__(self, other):
         if not other: return False
-        if not isinstance(other, State): 
+        if not isinstance(other, State):
             raise Exception('Cannot compare State with %s.' % type(other))
-        if not np.array_equal(self.agents, other.agents): return False
-        if not np.array_equal(self.boxes, other.boxes): return False
-        return True
-    
+        return self.agents == other.agents and self.boxes == other.boxes
+
     def __lt__(self, other):
         return self.h <= other.h
-    
+
     def extract_actors(self) -> '[Actors, ...]':
-        return self.__agents, self.__boxes
-    
-    def extract_actions(self) -> '[Action, ...]':
+        """Agent and Box objects at the locations of this state.
+        The actors given to the search are not changed.
+        """
+        context = self._context
+        level = context.level
+
+        _agents = []
+        for agent, cell in zip(context.agents, self.agents):
+            _agent = copy(agent)
+            _agent.move(level.location_at(cell))
+            _agents.append(_agent)
+
+        _boxes = []
+        for box, cell in zip(context.boxes, self.boxes):
+            _box = copy(box)
+            _box.move(level.location_at(cell))
+            _boxes.append(_box)
+
+        return np.array(_agents), np.array(_boxes)
+
+    def extract_actions(self) -> '[{Agent: Action}, ...]':
+        agents = self._context.agents
         plan = [None for _ in range(self._g)]
         state = self
         while state._joint_actions is not None:
-            plan[state._g - 1] = state._joint_actions
+            plan[state._g - 1] = dict(zip(agents, state._joint_actions))
             state = state._parent
         return plan
-    
+
     def __penalty_for_placement(self):
         """ Penalizes states where agents are standing where they should not
         such as other agent's goals.
         """
-        
+
         PCONST = 100
         penalty = 0
-        
-        if self.__boxes.size:
+        context = self._context
+
+        if self.boxes:
             # Boxes are in their location
-            all_boxes_done = sum([box.has_reached() for box in self.__boxes])
-            
-            if all_boxes_done:
-                for agent in self.__agents:
-                    other_goals = {loc for loc, goal in self.__goals.items() if goal.color != agent.color}
+            all_boxes_done = sum(cell == target for cell, target in zip(self.boxes, context.box_targets))
 
-                    for agent in self.__agents:
-                        if agent.location in other_goals:
+            if all_boxes_done:
+                for other_goals in context.other_goals:
+                    for cell in self.agents:
+                        if cell in other_goals:
                             penalty += PCONST
         return penalty
-    
+
     def __box_to_goal_heuristic(self):
         # Distance from box to its destination
-        return sum(box.distance(box.destination) for box in self.__boxes if box.destination)
-    
+        return sum(
+            distances[cell] for cell, distances in zip(self.boxes, self._context.box_distances) if distances
+        )
+
     def __agent_to_desire_heuristic(self):
         # Distance from agent to desire (either box or goal)
-        return sum(agent.distance(agent.desire.location) for agent in self.__agents)
-    
+        return sum(
+            distances[cell] for cell, distances in zip(self.agents, self._context.agent_distances) if distances
+        )
+
     @property
     def h(self):
-        return self._g + \
-            self.__agent_to_desire_heuristic() + \
-            self.__box_to_goal_heuristic() + \
-            self.__penalty_for_placement()
-    
-    def move_box(self, rboxloc: Location, nloc: Location):
-        """Change object in deepcopy
-        """
-        for nb, _dbox in enumerate(self.__boxes):
-            if _dbox.location == rboxloc:
-                self.__boxes[nb].move(self.__level.get_location(
-                    (nloc.row, nloc.col), translate=True))
-                return self.__boxes[nb]
-        raise Exception('Cannot find box %s.' % rboxloc)
-
-    def move_agent(self, ragent: Agent, aloc: Location):
-        """Change object in deepcopy
+        if self._h is None:
+            self._h = self._g + \
+                self.__agent_to_desire_heuristic() + \
+                self.__box_to_goal_heuristic() + \
+                self.__penalty_for_placement()
+        return self._h
+
+    def __apply_action(self, joint_moves: '((Action, int, int, int), ...)') -> 'State':
+        """Successor state. Returns None if the moves are in conflict with each other.
         """
-        # Get box in the copied state so we don't change the one we are in
-        for na, _dagt in enumerate(self.__agents):
-            if _dagt.identifier == ragent.identifier:
-                self.__agents[na].move(
-                    self.__level.get_location((aloc.row, aloc.col), translate=True)
-                )
-                return self.__agents[na]
-        raise Exception('Cannot find agent %s.' % ragent)
-    
-    def __apply_action(self, joint_actions: '[Action, ...]') -> 'State':
-        _state = deepcopy(self)
-
-        for agent, action in joint_actions.items():
-            # Get the agent and box location of the executed Action
-            original_location = self.__level.location_from_action(agent.location, action)
-            move_location = self.__level.location_from_action(agent.location, action, execute=True)
-            
-            if action.type == ActionType.NoOp:
-                pass
-            elif action.type == ActionType.Move:
-                _state.move_agent(agent, move_location)
-            elif action.type in (ActionType.Pull, ActionType.Push):
-                if action.type is ActionType.Pull:
-                    box_loc = original_location[1]
-                    agt_mov_loc = move_location[0]
-                    box_mov_loc = move_location[1]
-                else:
-                    box_loc = original_location[0]
-                    agt_mov_loc = move_location[0]
-                    box_mov_loc = move_location[1]
-                _state.move_agent(agent, agt_mov_loc)
-                _state.move_box(box_loc, box_mov_loc)
-        
-        _state._joint_actions = deepcopy(joint_actions)
+        context = self._context
+        agents = list(self.agents)
+        boxes = list(self.boxes)
+        box_at = context.box_at
+        destinations = set()
+        moved_boxes = set()
+        key = self.__hash__()
+
+        for na, (action, agent_to, box_from, box_to) in enumerate(joint_moves):
+            if action.type is ActionType.NoOp:
+                continue
+
+            if agent_to in destinations:
+                return None
+            destinations.add(agent_to)
+            keys = context.agent_keys[na]
+            key ^= keys[agents[na]] ^ keys[agent_to]
+            agents[na] = agent_to
+
+            if box_from < 0:
+                continue
+
+            nb = box_at[box_from]
+            if nb in moved_boxes or box_to in destinations:
+                return None
+            moved_boxes.add(nb)
+            destinations.add(box_to)
+            keys = context.box_keys[nb]
+            key ^= keys[box_from] ^ keys[box_to]
+            boxes[nb] = box_to
+
+        _state = State(context, tuple(agents), tuple(boxes))
+        _state._hash = key
+        _state._joint_actions = tuple(move[0] for move in joint_moves)
         _state._parent = self
-        _state._g += 1
+        _state._g = self._g + 1
         return _state
-    
-    def get_expanded_states(self) -> '{State, ...}':
+
+    def __occupy(self):
+        """Fill the occupancy bitmap and box indexes of the context with this state.
+        """
+        context = self._context
+
+        for cell in self.agents:
+            context.occupied[cell] = 1
+
+        for nb, cell in enumerate(self.boxes):
+            context.occupied[cell] = 1
+            context.box_at[cell] = nb
+
+    def __vacate(self):
+        """Clear what __occupy filled.
+        """
+        context = self._context
+
+        for cell in self.agents:
+            context.occupied[cell] = 0
+
+        for cell in self.boxes:
+            context.occupied[cell] = 0
+            context.box_at[cell] = -1
+
+    def successor(self, joint_actions: '(Action, ...)') -> 'State':
+        """State after performing the given joint action (one Action per agent).
+        Returns None if the joint action is not applicable.
+        """
+        context = self._context
+        self.__occupy()
+
+        try:
+            joint_moves = []
+
+            for na, (cell, action) in enumerate(zip(self.agents, joint_actions)):
+                move = next((move for move in context.moves[cell] if move[0] is action), None)
+
+                if move is None or not self.__is_applicable(na, move):
+                    return None
+                joint_moves.append(move)
+
+            return self.__apply_action(tuple(joint_moves))
+        finally:
+            self.__vacate()
+
+    def get_expanded_states(self) -> '[State, ...]':
         expanded_states = []
-        
-        agents = self.agents
-        applicable_actions = {
-            agent: [action for action in Action if self.__is_applicable(agent, action)] for agent in agents
-        }
-        joint_action = {agent: [] for agent in agents}
-        actions_permutation = {agent: 0 for agent in agents}
-        num_agents = len(agents)
-
-        while True:
-            for agent in agents:
-                joint_action[agent] = applicable_actions[agent][actions_permutation[agent]]
-            
-            expanded_states.append(self.__apply_action(joint_action))
-
-            # Advance permutation.
-            done = False
-            _cnt = 0
-            for agent in agents:
-                if actions_permutation[agent] < len(applicable_actions[agent]) - 1:
-                    actions_permutation[agent] += 1
+        context = self._context
+        self.__occupy()
+
+        try:
+            applicable_moves = [
+                [move for move in context.moves[cell] if self.__is_applicable(na, move)]
+                for na, cell in enumerate(self.agents)
+            ]
+            actions_permutation = [0 for _ in self.agents]
+            num_agents = len(self.agents)
+
+            while True:
+                joint_moves = tuple(
+                    applicable_moves[na][actions_permutation[na]] for na in range(num_agents)
+                )
+
+                _state = self.__apply_action(joint_moves)
+                if _state is not None:
+                    expanded_states.append(_state)
+
+                # Advance permutation.
+                done = False
+                for na in range(num_agents):
+                    if actions_permutation[na] < len(applicable_moves[na]) - 1:
+                        actions_permutation[na] += 1
+                        break
+                    else:
+                        actions_permutation[na] = 0
+                        if na == num_agents - 1:
+                            done = True
+
+                # Last permutation?
+                if done:
                     break
-                else:
-                    actions_permutation[agent] = 0
-                    if _cnt == num_agents - 1:
-                        done = True
-                _cnt += 1
-                
-            # Last permutation?
-            if done:
-                break
+        finally:
+            self.__vacate()
 
         return expanded_states
-        
+
     def is_goal_state(self) -> 'bool':
-        if self.__boxes.size:
-            for box in self.__boxes:
-                if box.destination and box.location != box.destination:
-                    return False
-            return True
-        return not sum(agent.distance(agent.desire.location) for agent in self.__agents)
-    
-    def __is_applicable(self, agent: Agent, action: 'Action') -> 'bool':
+        if self.boxes:
+            return self._context.boxes_done(self.boxes)
+        return self._context.agents_done(self.agents)
+
+    def __is_applicable(self, na: int, move: '(Action, int, int, int)') -> 'bool':
+        """Whether an agent can perform a move of the MoveTable (walls are already ruled out).
+        Expects the occupancy bitmap of the context to be filled for this state.
+        """
+        action, agent_to, box_from, box_to = move
+        context = self._context
+
         if action.type is ActionType.NoOp:
             return True
-        
+
         if action.type is ActionType.Move:
-            try:
-                location = self.__level.location_from_action(agent.location, action)
-                return self.__is_location_free(location)
-            except Exception:
-                # Location does not exist
-                return False
-
-        if action.type in (ActionType.Pull, ActionType.Push):
-            try:
-                location = self.__level.location_from_action(agent.location, action)
-                
-                if action.type is ActionType.Pull:
-                    return self.__is_location_free(location[0]) and self.__is_location_with_box(location[1], agent.color)
-                # Else
-                return self.__is_location_free(location[1]) and self.__is_location_with_box(location[0], agent.color)
-            except Exception:
-                return False
-    
-    def __is_location_with_box(self, location: Location, color: Color):
-        """Check whether a location has a box of the same color as the agent.
-        """
-        for box in self.__boxes:
-            if box.color == color and box.location == location:
-                return True
-        return False
-    
-    def __is_location_free(self, location: Location):
-        if not location or location.is_wall:
+            return not context.occupied[agent_to]
+
+        nb = context.box_at[box_from]
+        if nb < 0 or context.box_colors[nb] != context.agent_colors[na]:
             return False
 
-        agent_locations = set(agent.location for agent in self.__agents)
-        box_locations = set(box.location for box in self.__boxes)
-        
-        if location in agent_locations.union(box_locations):
+        # The box could not reach its target anymore
+        dead = context.box_dead[nb]
+        if dead is not None and dead[box_to]:
+            context.deadlocks += 1
             return False
-        
-        return True
+
+        if action.type is ActionType.Pull:
+            return not context.occupied[agent_to]
+
+        # Push
+        return not context.occupied[box_to]
@@ -0,0 +1,100 @@
+import sys
+import queue
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class ActionStream(object):
+    """Sends joint actions to the server while planning goes on.
+
+    Joint actions queued with send() are written by a writer thread, and a reader
+    thread collects the server responses as they come, so neither the planner nor
+    the server waits for the other and the client never blocks on readline.
+    close() waits for the response to every joint action sent.
+    """
+
+    def __init__(self, server_messages=None, out=None):
+        self.__in = server_messages or sys.stdin
+        self.__out = out or sys.stdout
+
+        self.__queue = queue.Queue()
+        self.__responses = []
+        self.__queued = 0
+        self.__sent = 0
+        self.__eof = False
+        self.__condition = threading.Condition()
+
+        self.__writer = threading.Thread(target=self.__write, name='stream-writer', daemon=True)
+        self.__reader = threading.Thread(target=self.__read, name='stream-reader', daemon=True)
+        self.__writer.start()
+        self.__reader.start()
+
+    def __write(self):
+        while True:
+            joint_action = self.__queue.get()
+
+            if joint_action is None:
+                return
+
+            print("|".join(a.name_ for a in joint_action), file=self.__out, flush=True)
+
+            with self.__condition:
+                self.__sent += 1
+                self.__condition.notify_all()
+
+    def __read(self):
+        while True:
+            line = self.__in.readline()
+
+            with self.__condition:
+                if not line:
+                    self.__eof = True
+                    self.__condition.notify_all()
+                    return
+
+                self.__responses.append(line.strip())
+                self.__condition.notify_all()
+
+    @property
+    def sent(self) -> int:
+        """Joint actions written to the server so far.
+        """
+        return self.__sent
+
+    @property
+    def responses(self) -> [str, ...]:
+        """Server responses received so far, one per joint action.
+        """
+        with self.__condition:
+            return list(self.__responses)
+
+    def send(self, actions: [['Action', ...], ...]):
+        """Queue joint actions for the server. Returns right away.
+        """
+        for joint_action in actions:
+            with self.__condition:
+                self.__queued += 1
+            self.__queue.put(tuple(joint_action))
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until every queued joint action is sent and answered.
+
+        Returns:
+            bool: False on timeout or if the server closed the connection first
+        """
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__eof or len(self.__responses) >= self.__queued, timeout)
+            return len(self.__responses) >= self.__queued
+
+    def close(self, timeout: float = None) -> bool:
+        """Send what is left, wait for the responses and stop the writer.
+        """
+        done = self.wait(timeout)
+        self.__queue.put(None)
+        self.__writer.join(timeout)
+
+        log.debug("Stream closed: %d joint actions sent, %d responses.", self.__sent, len(self.__responses))
+        return done
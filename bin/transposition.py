@@ -0,0 +1,57 @@
+class TranspositionTable(object):
+    """Explored set of the state search.
+
+    States are found by their Zobrist hash (see State.__hash__) and told apart by
+    their positions, so a hash collision never merges two different states. Only
+    the position tuples of a state and its cost are kept, not the State itself:
+    explored branches nobody leads to anymore can be freed.
+    """
+
+    def __init__(self):
+        self.__table = {}  # hash: (agents, boxes, g)
+        self.__collisions = {}  # (agents, boxes): g, for the states whose hash was taken
+
+    def __len__(self):
+        return len(self.__table) + len(self.__collisions)
+
+    def __contains__(self, state: 'State') -> bool:
+        return self.get(state) is not None
+
+    def clear(self):
+        self.__table.clear()
+        self.__collisions.clear()
+
+    @property
+    def collisions(self) -> int:
+        return len(self.__collisions)
+
+    def get(self, state: 'State') -> int:
+        """Cost with which the positions of the state were explored, or None.
+        """
+        entry = self.__table.get(hash(state))
+
+        if entry is None:
+            return None
+
+        if entry[0] == state.agents and entry[1] == state.boxes:
+            return entry[2]
+
+        if self.__collisions:
+            return self.__collisions.get((state.agents, state.boxes))
+        return None
+
+    def add(self, state: 'State'):
+        """Record the positions of a state, with the lowest cost they were explored with.
+        """
+        key = hash(state)
+        entry = self.__table.get(key)
+        g = state._g
+
+        if entry is None:
+            self.__table[key] = (state.agents, state.boxes, g)
+        elif entry[0] == state.agents and entry[1] == state.boxes:
+            if g < entry[2]:
+                self.__table[key] = (state.agents, state.boxes, g)
+        else:
+            positions = (state.agents, state.boxes)
+            self.__collisions[positions] = min(g, self.__collisions.get(positions, g))